@@ -1,9 +1,15 @@
 from django.urls import path
+
+from posts.caching import shared_cache_page
 from . import views
 
 app_name = 'about'
 
+ABOUT_CACHE_TIME = 60 * 60 * 24
+
 urlpatterns = [
-    path('author/', views.AboutAuthor.as_view(), name='author'),
-    path('tech/', views.AboutTech.as_view(), name='tech'),
+    path('author/', shared_cache_page(ABOUT_CACHE_TIME, 'about_author')(
+        views.AboutAuthor.as_view()), name='author'),
+    path('tech/', shared_cache_page(ABOUT_CACHE_TIME, 'about_tech')(
+        views.AboutTech.as_view()), name='tech'),
 ]
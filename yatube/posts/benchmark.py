@@ -0,0 +1,423 @@
+"""
+Нагрузочный замер основных страниц на синтетических данных.
+
+generate() создаёт набор данных заданного размера: пользователей,
+группы, посты с картинками и комментарии. Активность авторов,
+популярность групп и постов и граф подписок подчиняются степенному
+закону (несколько очень популярных авторов и длинный хвост). measure()
+запрашивает страницы через тестовый клиент Django и собирает время
+ответа и число SQL-запросов; report() сводит их в перцентили. Запуск —
+команда benchmark, результаты пишутся в JSON для сравнения между
+коммитами.
+
+sqlite_concurrency() отдельно замеряет чтение ленты при одновременной
+записи в SQLite с настройками по умолчанию и с SQLITE_PRAGMAS (команда
+bench_sqlite).
+"""
+
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from mixer.backend.django import mixer
+from PIL import Image
+
+from . import counters, search, sqlite, timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+# Тексты постов и комментариев берутся из заранее созданного набора:
+# Faker слишком медленный, чтобы вызывать его на каждую из миллиона строк.
+TEXT_POOL_SIZE = 2000
+USERNAME_PREFIX = 'bench_'
+SCENARIOS = ('index', 'group_posts', 'profile', 'post_detail',
+             'follow_index', 'search')
+PERCENTILES = (50, 95, 99)
+
+
+def power_law_weights(count, alpha):
+    """Накопленные веса рангов 1..count с вероятностью ~ 1 / rank^alpha."""
+    weights, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += rank ** -alpha
+        weights.append(total)
+    return weights
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bulk_create(model, rows) -> int:
+    created = 0
+    for batch in _batches(rows):
+        model.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+@contextmanager
+def explicit_dates(model, *names):
+    """
+    Отключает auto_now_add у полей: bulk_create иначе заменит заданные
+    даты временем вставки.
+    """
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def create_images(count, rng) -> list:
+    """Сохраняет count разных картинок, возвращает имена их файлов."""
+    field = Post._meta.get_field('image')
+    names = []
+    for _ in range(count):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        content = BytesIO()
+        Image.new('RGB', (960, 540), color).save(content, 'JPEG')
+        names.append(field.storage.save(
+            field.generate_filename(None, 'bench.jpg'),
+            ContentFile(content.getvalue())))
+    return names
+
+
+def generate(users=1000, posts=20000, groups=20, comments=20000,
+             follows=20, images=10, image_share=0.2, alpha=1.1, days=365,
+             seed=0) -> dict:
+    """
+    Создаёт набор данных и возвращает его параметры. follows — среднее
+    число подписок пользователя, image_share — доля постов с картинкой.
+    Массовая вставка идёт в обход сигналов, поэтому счётчики, поисковый
+    индекс и ленты подписок пересчитываются в конце целиком.
+    """
+    rng = random.Random(seed)
+    faker = Faker('ru_RU')
+    faker.seed_instance(seed)
+    texts = [faker.paragraph(nb_sentences=rng.randint(1, 6))
+             for _ in range(TEXT_POOL_SIZE)]
+    started = time.perf_counter()
+
+    _bulk_create(User, (
+        User(username=f'{USERNAME_PREFIX}{i}', first_name=faker.first_name(),
+             last_name=faker.last_name())
+        for i in range(users)))
+    user_ids = list(User.objects.filter(
+        username__startswith=USERNAME_PREFIX).values_list('pk', flat=True))
+    rng.shuffle(user_ids)
+    user_weights = power_law_weights(len(user_ids), alpha)
+
+    group_list = mixer.cycle(groups).blend(
+        Group, slug=mixer.sequence(f'{USERNAME_PREFIX}group_{{0}}'),
+        title=mixer.faker.sentence, description=mixer.faker.text)
+    group_weights = power_law_weights(len(group_list), alpha)
+    image_names = create_images(images, rng)
+
+    now = timezone.now()
+
+    def new_post():
+        group = None
+        if group_list and rng.random() < 0.7:
+            group = rng.choices(group_list, cum_weights=group_weights)[0]
+        image = ''
+        if image_names and rng.random() < image_share:
+            image = rng.choice(image_names)
+        return Post(
+            author_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+            group=group, image=image, text=rng.choice(texts),
+            pub_date=now - timedelta(days=rng.random() * days))
+
+    with explicit_dates(Post, 'pub_date'):
+        _bulk_create(Post, (new_post() for _ in range(posts)))
+    generated = Post.objects.filter(
+        author__username__startswith=USERNAME_PREFIX)
+    post_ids = list(generated.values_list('pk', flat=True))
+    dates = generated.aggregate(first=Min('pub_date'), last=Max('pub_date'))
+    rng.shuffle(post_ids)
+    post_weights = power_law_weights(len(post_ids), alpha)
+    _bulk_create(Comment, (
+        Comment(post_id=rng.choices(post_ids, cum_weights=post_weights)[0],
+                author_id=rng.choice(user_ids), text=rng.choice(texts))
+        for _ in range(comments if post_ids else 0)))
+
+    def user_follows(user_id):
+        # Число подписок тоже распределено по Парето со средним follows.
+        wanted = min(len(user_ids) - 1,
+                     int(rng.paretovariate(2) * follows / 2))
+        authors = set(rng.choices(user_ids, cum_weights=user_weights,
+                                  k=wanted))
+        authors.discard(user_id)
+        return (Follow(user_id=user_id, author_id=author)
+                for author in authors)
+
+    follow_count = _bulk_create(Follow, (
+        follow for user_id in user_ids for follow in user_follows(user_id)))
+
+    counters.reconcile()
+    if search.is_available():
+        search.rebuild(Post.objects.all())
+    if timeline.is_enabled():
+        timeline.rebuild()
+    return {
+        'users': users, 'posts': posts, 'groups': groups,
+        'comments': comments, 'follows': follow_count, 'images': images,
+        'image_share': image_share, 'alpha': alpha, 'days': days,
+        'pub_date_days': round(
+            (dates['last'] - dates['first']).total_seconds() / 86400, 1)
+        if post_ids else 0,
+        'seed': seed, 'image_names': image_names,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def pick_targets(rng, sample=200) -> dict:
+    """Случайные группы, авторы, посты и читатели для запросов."""
+    def sample_of(queryset, field):
+        values = list(queryset.values_list(field, flat=True)[:sample * 10])
+        return rng.sample(values, min(sample, len(values)))
+
+    words = [word for text in sample_of(Post.objects.all(), 'text')
+             for word in search.WORD_RE.findall(text) if len(word) > 4]
+    return {
+        'groups': sample_of(Group.objects.all(), 'slug'),
+        'authors': sample_of(User.objects.filter(posts__isnull=False)
+                             .distinct(), 'username'),
+        'posts': sample_of(Post.objects.all(), 'pk'),
+        'readers': sample_of(User.objects.filter(follower__isnull=False)
+                             .distinct(), 'pk'),
+        'words': words[:sample] or ['пост'],
+    }
+
+
+def scenario_request(name, targets, rng):
+    """URL и пользователь (или None для гостя) очередного запроса."""
+    if name == 'index':
+        return reverse('posts:home'), None
+    if name == 'group_posts':
+        return reverse('posts:group_list',
+                       args=[rng.choice(targets['groups'])]), None
+    if name == 'profile':
+        return reverse('posts:profile',
+                       args=[rng.choice(targets['authors'])]), None
+    if name == 'post_detail':
+        return reverse('posts:post_detail',
+                       args=[rng.choice(targets['posts'])]), None
+    if name == 'follow_index':
+        return reverse('posts:follow_index'), rng.choice(targets['readers'])
+    if name == 'search':
+        return (reverse('posts:search_results')
+                + f'?query={rng.choice(targets["words"])}'), None
+    raise ValueError(f'Неизвестный сценарий {name}')
+
+
+def measure(scenarios=SCENARIOS, iterations=100, warm_cache=False,
+            seed=0) -> dict:
+    """
+    Запрашивает страницы каждого сценария iterations раз и возвращает
+    {сценарий: [(мс, число запросов), ...]}. Без warm_cache кеш
+    очищается перед каждым запросом, то есть замеряется отрисовка.
+    """
+    rng = random.Random(seed)
+    targets = pick_targets(rng)
+    clients = {}
+    samples = {}
+    for name in scenarios:
+        if not targets['readers'] and name == 'follow_index':
+            continue
+        if not targets['groups'] and name == 'group_posts':
+            continue
+        samples[name] = []
+        for _ in range(iterations):
+            url, user_id = scenario_request(name, targets, rng)
+            if user_id not in clients:
+                clients[user_id] = Client()
+                if user_id is not None:
+                    clients[user_id].force_login(
+                        User.objects.get(pk=user_id))
+            if not warm_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = clients[user_id].get(url)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f'{url} ответил {response.status_code}')
+            samples[name].append((elapsed, len(queries)))
+    return samples
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(samples, dataset=None, warm_cache=False) -> dict:
+    """Сводка замеров для сохранения в JSON."""
+    scenarios = {}
+    for name, values in samples.items():
+        timings = [elapsed for elapsed, _ in values]
+        scenarios[name] = {
+            'requests': len(values),
+            **{f'p{percent}': round(percentile(timings, percent), 3)
+               for percent in PERCENTILES},
+            'mean': round(statistics.mean(timings), 3),
+            'max': round(max(timings), 3),
+            'queries': statistics.median(queries for _, queries in values),
+        }
+    return {
+        'commit': current_commit(),
+        'created': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'settings': {
+            'POSTS_PAGINATION': settings.POSTS_PAGINATION,
+            'FOLLOW_TIMELINE': settings.FOLLOW_TIMELINE,
+            'warm_cache': warm_cache,
+        },
+        'dataset': dataset,
+        'scenarios': scenarios,
+    }
+
+
+# Конкурентный замер SQLite. Воркеры — отдельные процессы, как воркеры
+# gunicorn, каждый со своим соединением к временной копии схемы постов.
+SQLITE_PROFILES = {
+    # Настройки SQLite и Django по умолчанию.
+    'default': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'tuned': {'journal_mode': settings.SQLITE_JOURNAL_MODE,
+              **settings.SQLITE_PRAGMAS},
+}
+FEED_SQL = ('SELECT id, author_id, text, pub_date FROM bench_post '
+            'ORDER BY pub_date DESC, id DESC LIMIT 10 OFFSET ?')
+
+
+def create_sqlite_dataset(path, rows, journal_mode, seed=0) -> None:
+    rng = random.Random(seed)
+    with sqlite3.connect(path) as db:
+        # Режим журнала хранится в файле базы. Включать его из воркеров
+        # нельзя: одновременная смена режима может сразу вернуть
+        # «database is locked», не дожидаясь busy_timeout.
+        sqlite.apply_pragmas(db, {'journal_mode': journal_mode})
+        db.execute('CREATE TABLE bench_post (id INTEGER PRIMARY KEY, '
+                   'author_id INTEGER, text TEXT, pub_date TEXT)')
+        db.execute('CREATE INDEX bench_post_pub_date '
+                   'ON bench_post (pub_date, id)')
+        db.executemany(
+            'INSERT INTO bench_post (author_id, text, pub_date) '
+            'VALUES (?, ?, ?)',
+            ((rng.randrange(1000), 'пост ' * rng.randint(5, 100),
+              str(datetime(2020, 1, 1) + timedelta(minutes=i)))
+             for i in range(rows)))
+    db.close()
+
+
+def sqlite_worker(path, pragmas, role, start, deadline, seed):
+    """
+    С момента start до deadline читает первые страницы ленты или пишет
+    посты по одному в автокоммите. Возвращает (задержки операций в мс,
+    число ошибок блокировки).
+    """
+    rng = random.Random(seed)
+    db = sqlite3.connect(path, isolation_level=None)
+    sqlite.apply_pragmas(db, {name: value for name, value in pragmas.items()
+                              if name != 'journal_mode'})
+    timings, busy = [], 0
+    time.sleep(max(0, start - time.time()))
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == 'reader':
+                db.execute(FEED_SQL, [rng.randrange(10) * 10]).fetchall()
+                db.execute('SELECT COUNT(*) FROM bench_post').fetchone()
+            else:
+                db.execute(
+                    'INSERT INTO bench_post (author_id, text, pub_date) '
+                    'VALUES (?, ?, datetime())',
+                    [rng.randrange(1000), 'новый пост ' * 20])
+        except sqlite3.OperationalError:
+            busy += 1
+            continue
+        timings.append((time.perf_counter() - started) * 1000)
+    db.close()
+    return timings, busy
+
+
+def sqlite_concurrency(readers=4, writers=1, seconds=5.0, rows=20000,
+                       profiles=tuple(SQLITE_PROFILES)) -> dict:
+    """
+    Для каждого набора прагм из SQLITE_PROFILES запускает readers
+    читателей и writers писателей на seconds секунд и возвращает
+    пропускную способность и задержки чтения и записи.
+    """
+    results = {}
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            create_sqlite_dataset(
+                path, rows, SQLITE_PROFILES[profile]['journal_mode'])
+            roles = ['reader'] * readers + ['writer'] * writers
+            # Всем процессам даётся время запуститься до общего старта.
+            start = time.time() + 1
+            with multiprocessing.Pool(len(roles)) as pool:
+                outcomes = pool.starmap(sqlite_worker, [
+                    (path, SQLITE_PROFILES[profile], role, start,
+                     start + seconds, seed)
+                    for seed, role in enumerate(roles)])
+        results[profile] = {}
+        for role in ('reader', 'writer'):
+            timings = [elapsed for (values, _), worker_role
+                       in zip(outcomes, roles) if worker_role == role
+                       for elapsed in values]
+            results[profile][role] = {
+                'ops_per_second': round(len(timings) / seconds, 1),
+                'p50': round(percentile(timings, 50), 3) if timings else None,
+                'p99': round(percentile(timings, 99), 3) if timings else None,
+                'busy': sum(busy for (_, busy), worker_role
+                            in zip(outcomes, roles) if worker_role == role),
+            }
+    return results
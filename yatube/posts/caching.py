@@ -0,0 +1,209 @@
+"""
+Кеширование страниц лент с версионированными ключами.
+
+Каждая закешированная страница зависит от набора «поколений»: общего
+для главной ленты, своего для каждой группы и каждого автора. Сигналы
+Post, Group, Comment и Follow увеличивают нужные поколения, и старые
+записи кеша просто перестают находиться, поэтому время жизни кеша можно
+делать большим без риска показать устаревшую ленту.
+
+Это верно, только если кеш общий для всех воркеров. В кеше процесса
+(LocMemCache) поколения увеличивает лишь воркер, сохранивший пост, а
+остальные продолжают отдавать свои копии, поэтому там страницы живут не
+дольше LOCAL_PAGE_CACHE_TIME (page_timeout).
+"""
+
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control, patch_response_headers
+from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_cookie
+
+from . import routers
+
+GENERATION_PREFIX = 'posts_generation'
+# Кеши, которые видит только свой процесс.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+FEED = 'feed'
+GROUPS = 'groups'
+
+
+def group_scope(slug: str) -> str:
+    return f'group:{slug}'
+
+
+def author_scope(username: str) -> str:
+    return f'author:{username}'
+
+
+def _key(scope: str) -> str:
+    return f'{GENERATION_PREFIX}:{scope}'
+
+
+def _bumped_key(scope: str) -> str:
+    return f'{GENERATION_PREFIX}_bumped:{scope}'
+
+
+def _new_generation() -> int:
+    # Уникальное значение вместо нуля: если счётчик вытеснен из кеша,
+    # страницы, закешированные со старым значением, не воскреснут.
+    return time.time_ns()
+
+
+def get_generations(*scopes) -> list:
+    keys = [_key(scope) for scope in scopes]
+    stored = cache.get_many(keys)
+    missing = {key: _new_generation() for key in keys if key not in stored}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        stored.update(missing)
+    return [stored[key] for key in keys]
+
+
+def _incr(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(_key(scope))
+        except ValueError:
+            cache.set(_key(scope), _new_generation(), timeout=None)
+    if settings.DATABASE_REPLICAS:
+        # Отметка для recently_bumped(): реплики могут ещё не знать
+        # об изменении, из-за которого сменилось поколение.
+        cache.set_many({_bumped_key(scope): True for scope in scopes},
+                       settings.REPLICA_PIN_SECONDS)
+
+
+def recently_bumped(*scopes) -> bool:
+    """
+    Менялось ли какое-то из поколений за последние REPLICA_PIN_SECONDS
+    секунд — время, за которое реплики догоняют основную базу.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return False
+    return bool(cache.get_many([_bumped_key(scope) for scope in scopes]))
+
+
+def bump(*scopes) -> None:
+    """
+    Инвалидирует все страницы, зависящие от указанных поколений. Внутри
+    транзакции поколения увеличиваются ещё раз после коммита: запрос,
+    пришедший до него, мог закешировать старые данные под новым
+    поколением.
+    """
+    scopes = set(scopes)
+    _incr(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _incr(scopes))
+
+
+def page_timeout(timeout) -> int:
+    """Время жизни страницы с учётом того, общий ли кеш у воркеров."""
+    if settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS:
+        return min(timeout, settings.LOCAL_PAGE_CACHE_TIME)
+    return timeout
+
+
+def is_anonymous(request) -> bool:
+    """
+    Гость определяется по отсутствию cookie сессии, не обращаясь к самой
+    сессии: иначе SessionMiddleware добавит к ответу Vary: Cookie.
+    """
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def _patch_browser_headers(response, max_age, **kwargs):
+    """
+    Заменяет время жизни, выставленное cache_page для своей записи, на
+    то, сколько ответ может храниться вне сервера.
+    """
+    if response.has_header('Expires'):
+        del response['Expires']
+    patch_response_headers(response, max_age)
+    patch_cache_control(response, **kwargs)
+
+
+def shared_cache_page(timeout, key_prefix, primary=False):
+    """
+    Кеширует страницу так, чтобы гости получали одну общую копию.
+
+    Для гостя view выполняется без обращения к сессии (request.user
+    заменяется на AnonymousUser), ответ не зависит от cookie и
+    помечается Cache-Control: public, поэтому его может хранить и
+    обратный прокси. Авторизованные пользователи получают свою копию
+    с персональной шапкой: Vary: Cookie выставляется до кеширования
+    (SessionMiddleware добавляет его уже после декоратора).
+
+    cache_page берёт срок хранения записи из max-age ответа, поэтому
+    заголовки для браузера и прокси выставляются уже после записи в
+    кеш: на сервере страница живёт timeout секунд (её сбрасывают
+    поколения), прокси хранит гостевую копию ANONYMOUS_CACHE_TIME
+    секунд, а персональная копия приходит с max-age=0 и no-cache, чтобы
+    браузер не показывал её после изменений самого пользователя.
+    С primary=True страница отрисовывается по основной базе, а не по
+    реплике (см. cache_feed).
+    """
+    def decorator(view):
+        @wraps(view)
+        def render(request, *args, **kwargs):
+            if not primary:
+                return view(request, *args, **kwargs)
+            with routers.read_primary():
+                return view(request, *args, **kwargs)
+
+        @wraps(view)
+        def anonymous_view(request, *args, **kwargs):
+            request.user = AnonymousUser()
+            return render(request, *args, **kwargs)
+
+        anonymous_cached = cache_page(
+            timeout, key_prefix=f'{key_prefix}.anonymous')(anonymous_view)
+        personal_cached = cache_page(
+            timeout, key_prefix=key_prefix)(vary_on_cookie(render))
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if is_anonymous(request):
+                response = anonymous_cached(request, *args, **kwargs)
+                _patch_browser_headers(
+                    response, settings.ANONYMOUS_CACHE_TIME, public=True)
+            else:
+                response = personal_cached(request, *args, **kwargs)
+                _patch_browser_headers(
+                    response, 0, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_feed(timeout, key_prefix, scopes=lambda **kwargs: ()):
+    """
+    Аналог shared_cache_page, у которого в префикс ключа входят текущие
+    поколения ленты. scopes получает именованные аргументы view и
+    возвращает дополнительные поколения, от которых зависит страница.
+
+    Промах кеша отрисовывается по реплике, кроме первых
+    REPLICA_PIN_SECONDS секунд после смены поколения: тогда отстающая
+    реплика закрепила бы под новым поколением старые данные, и страница
+    читается из основной базы.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            page_scopes = (GROUPS, *scopes(**kwargs))
+            generations = get_generations(*page_scopes)
+            prefix = '.'.join([key_prefix, *map(str, generations)])
+            cached_view = shared_cache_page(
+                page_timeout(timeout), prefix,
+                primary=recently_bumped(*page_scopes))(view)
+            return cached_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,177 @@
+"""
+Денормализованные счётчики: посты и подписчики автора, комментарии
+поста, посты группы.
+
+Счётчики меняются атомарными UPDATE ... SET x = x ± 1 (F-выражения) из
+сигналов сохранения и удаления Post, Comment и Follow, поэтому страницы
+показывают их без COUNT-запросов. Расхождения, накопившиеся из-за
+массовых операций в обход сигналов, исправляет reconcile() (команда
+reconcile_counters).
+
+Из них же берутся размеры лент для паджинатора по номерам страниц:
+лента группы и автора — готовые счётчики, лента подписок — сумма
+счётчиков авторов, главная лента — число в кеше, которое сигналы
+меняют при публикации и удалении постов (feed_total, follow_total).
+"""
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import AuthorStats, Follow, Group, Post
+
+FEED_TOTAL_KEY = 'posts_feed_total'
+
+
+def _change(queryset, delta, *fields) -> int:
+    return queryset.update(**{
+        field: Greatest(F(field) + delta, 0) for field in fields
+    })
+
+
+def change_author(user_id, delta, *fields) -> None:
+    stats = AuthorStats.objects.filter(user_id=user_id)
+    if not _change(stats, delta, *fields) and delta > 0:
+        # Строки ещё нет: считаем значения честно и сохраняем. При
+        # уменьшении строку не создаём — пользователь может удаляться.
+        reconcile_authors(global_apps, [user_id])
+
+
+def change_post(post_id, delta) -> None:
+    _change(Post.objects.filter(pk=post_id), delta, 'comments_count')
+
+
+def change_group(group_id, delta) -> None:
+    if group_id is not None:
+        _change(Group.objects.filter(pk=group_id), delta, 'posts_count')
+
+
+def _follow_total_key(user_id) -> str:
+    return f'posts_follow_total:{user_id}'
+
+
+def feed_total() -> int:
+    """
+    Число постов главной ленты. Пока постов не больше
+    FEED_COUNT_EXACT_LIMIT, они считаются честно; дальше берётся оценка
+    по наибольшему id — без прохода по таблице. Точное значение
+    записывают reconcile() и паджинатор, заметивший, что оценка неверна:
+    кеш процесса (LocMemCache) других воркеров не видит change_feed().
+    """
+    total = cache.get(FEED_TOTAL_KEY)
+    if total is None:
+        total = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+        if total <= settings.FEED_COUNT_EXACT_LIMIT:
+            total = Post.objects.count()
+        cache.set(FEED_TOTAL_KEY, total, settings.FEED_COUNT_TIMEOUT)
+    return total
+
+
+def set_feed_total(total) -> None:
+    cache.set(FEED_TOTAL_KEY, total, settings.FEED_COUNT_TIMEOUT)
+
+
+def change_feed(delta) -> None:
+    def change():
+        try:
+            cache.incr(FEED_TOTAL_KEY, delta)
+        except ValueError:
+            # Значения нет в кеше: его посчитает следующий запрос.
+            pass
+    transaction.on_commit(change)
+
+
+def follow_total(user) -> int:
+    """
+    Число постов в ленте подписок: сумма счётчиков авторов, на которых
+    подписан пользователь. Хранится FEED_COUNT_TIMEOUT секунд и
+    сбрасывается при подписке, отписке, публикации и удалении поста
+    автора из подписок: заниженная сумма обрезала бы последнюю страницу.
+    """
+    key = _follow_total_key(user.pk)
+    total = cache.get(key)
+    if total is None:
+        total = AuthorStats.objects.filter(
+            user__following__user=user).aggregate(
+            total=Coalesce(Sum('posts_count'), 0))['total']
+        cache.set(key, total, settings.FEED_COUNT_TIMEOUT)
+    return total
+
+
+def forget_follow_total(user_id) -> None:
+    transaction.on_commit(lambda: cache.delete(_follow_total_key(user_id)))
+
+
+def forget_follower_totals(author_id) -> None:
+    """Сбрасывает follow_total всех подписчиков автора."""
+    keys = [_follow_total_key(user_id) for user_id in Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def stats_for(user):
+    """Счётчики пользователя; недостающая строка создаётся по факту."""
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        reconcile_authors(global_apps, [user.pk])
+        return AuthorStats.objects.get(user=user)
+
+
+def _count(model, field, outer='pk'):
+    """Подзапрос: число строк model, у которых field = внешняя строка."""
+    counted = (model.objects.filter(**{field: OuterRef(outer)})
+               .order_by().values(field).annotate(total=Count('pk'))
+               .values('total'))
+    return Coalesce(Subquery(counted), 0)
+
+
+def _fix(queryset, **expressions) -> int:
+    fixed = 0
+    for field, expression in expressions.items():
+        fixed += queryset.exclude(**{field: expression}).update(
+            **{field: expression})
+    return fixed
+
+
+def reconcile_authors(apps, user_ids=None) -> int:
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    AuthorStats.objects.bulk_create(
+        (AuthorStats(user_id=user_id)
+         for user_id in users.filter(stats__isnull=True)
+         .values_list('pk', flat=True)),
+        ignore_conflicts=True,
+    )
+    stats = AuthorStats.objects.filter(user__in=users)
+    counted = {
+        'posts_count': (Post, 'author'),
+        'followers_count': (Follow, 'author'),
+        'following_count': (Follow, 'user'),
+    }
+    return _fix(stats, **{
+        field: _count(model, lookup, outer='user_id')
+        for field, (model, lookup) in counted.items()
+    })
+
+
+def reconcile(apps=global_apps) -> int:
+    """Пересчитывает все счётчики, возвращает число исправленных строк."""
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Group = apps.get_model('posts', 'Group')
+    fixed = _fix(Post.objects.all(),
+                 comments_count=_count(Comment, 'post'))
+    fixed += _fix(Group.objects.all(), posts_count=_count(Post, 'group'))
+    if apps is global_apps:
+        set_feed_total(Post.objects.count())
+    return fixed + reconcile_authors(apps)
@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+from posts.models import Follow, Post
+from posts.views import POSTS_PER_PAGE
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает выборку ленты подписок слиянием постов авторов '
+        'и из материализованной ленты. Данные создаются во временной '
+        'транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--posts-per-author', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            reader = self.populate(options['authors'],
+                                   options['posts_per_author'])
+            merge = self.measure(options['repeat'], lambda: list(
+                Post.objects.feed().filter(
+                    author__in=reader.follower.values('author')
+                )[:POSTS_PER_PAGE]))
+            materialized = self.measure(options['repeat'], lambda: [
+                entry.post for entry in reader.timeline.select_related(
+                    'post__author', 'post__group')[:POSTS_PER_PAGE]])
+            transaction.set_rollback(True)
+        for name, timings in (('merge', merge),
+                              ('timeline', materialized)):
+            self.stdout.write(
+                f'{name:>8}: median {statistics.median(timings):.3f} ms, '
+                f'max {max(timings):.3f} ms')
+
+    def populate(self, authors, posts_per_author):
+        reader = User.objects.create(username='bench_follow_reader')
+        User.objects.bulk_create(
+            User(username=f'bench_follow_author_{i}') for i in range(authors))
+        users = User.objects.filter(
+            username__startswith='bench_follow_author_')
+        Post.objects.bulk_create(
+            (Post(author=author, text=f'Пост {i} автора {author.username}')
+             for author in users for i in range(posts_per_author)),
+            batch_size=timeline.BATCH_SIZE,
+        )
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in users)
+        for author in users:
+            timeline.backfill(reader, author)
+        return reader
+
+    def measure(self, repeat, query):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
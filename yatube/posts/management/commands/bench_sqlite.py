@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает чтение ленты из SQLite, пока идёт запись, с настройками '
+        'по умолчанию и с SQLITE_PRAGMAS. Читатели и писатели — отдельные '
+        'процессы, как воркеры gunicorn; база — временный файл.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=1)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument(
+            '--profile', action='append',
+            choices=list(benchmark.SQLITE_PROFILES),
+            help='Замерять только эти настройки (можно повторять).')
+        parser.add_argument('--output', help='Файл для результатов в JSON.')
+
+    def handle(self, *args, **options):
+        results = benchmark.sqlite_concurrency(
+            options['readers'], options['writers'], options['seconds'],
+            options['rows'],
+            options['profile'] or tuple(benchmark.SQLITE_PROFILES))
+        for profile, roles in results.items():
+            for role, stats in roles.items():
+                self.stdout.write(
+                    f'{profile:>8} {role}: {stats["ops_per_second"]} оп/с, '
+                    f'p50 {stats["p50"]} ms, p99 {stats["p99"]} ms, '
+                    f'блокировок {stats["busy"]}')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["output"]}'))
@@ -0,0 +1,81 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import benchmark, storage
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время ответа основных страниц (p50/p95/p99) на '
+        'синтетических данных. Данные создаются во временной транзакции '
+        'и откатываются, если не указан --keep; с --no-generate замер '
+        'идёт на данных, уже лежащих в базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя.')
+        parser.add_argument(
+            '--images', type=int, default=10,
+            help='Число разных картинок, общих для постов.')
+        parser.add_argument('--image-share', type=float, default=0.2)
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Показатель степенного распределения популярности.')
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument(
+            '--scenario', action='append', choices=benchmark.SCENARIOS,
+            help='Замерять только эти страницы (можно повторять).')
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help='Не очищать кеш перед запросами.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для результатов в JSON.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Сохранить созданные данные.')
+        parser.add_argument('--no-generate', action='store_true')
+
+    def handle(self, *args, **options):
+        dataset = None
+        with transaction.atomic():
+            if not options['no_generate']:
+                dataset = benchmark.generate(
+                    users=options['users'], posts=options['posts'],
+                    groups=options['groups'], comments=options['comments'],
+                    follows=options['follows'], images=options['images'],
+                    image_share=options['image_share'],
+                    alpha=options['alpha'], seed=options['seed'])
+                self.stdout.write(
+                    f'Данные созданы за {dataset["seconds"]} с')
+            samples = benchmark.measure(
+                options['scenario'] or benchmark.SCENARIOS,
+                options['iterations'], options['warm_cache'],
+                options['seed'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+        cache.clear()
+        if dataset and not options['keep']:
+            # Посты откачены, а картинки созданы только для замера.
+            for name in dataset['image_names']:
+                storage.release(name, Post.objects.all(), grace=0)
+
+        result = benchmark.report(samples, dataset, options['warm_cache'])
+        for name, stats in result['scenarios'].items():
+            self.stdout.write(
+                f'{name:>12}: p50 {stats["p50"]:.1f} ms, '
+                f'p95 {stats["p95"]:.1f} ms, p99 {stats["p99"]:.1f} ms, '
+                f'запросов {stats["queries"]}')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["output"]}'))
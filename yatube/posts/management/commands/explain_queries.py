@@ -0,0 +1,79 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from posts import slow_queries
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает самые затратные медленные запросы из журнала '
+        'slow_queries с их планами (EXPLAIN QUERY PLAN) и отмечает полные '
+        'проходы по таблицам и сортировки во временных B-деревьях. С --url '
+        'журнал не читается: запрашиваются указанные страницы, и '
+        'разбираются все их запросы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument(
+            '--url', action='append',
+            help='Разобрать запросы этой страницы (можно повторять).')
+        parser.add_argument('--reset', action='store_true',
+                            help='Очистить журнал после вывода.')
+
+    def collect(self, urls):
+        """Журнал запросов указанных страниц, без порога и общего файла."""
+        level = slow_queries.logger.level
+        slow_queries.logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_DB=None):
+                slow_queries.reset()
+                client = Client()
+                for url in urls:
+                    client.get(url)
+                entries = slow_queries.top(self.limit)
+                slow_queries.reset()
+        finally:
+            slow_queries.logger.setLevel(level)
+        return entries
+
+    def handle(self, *args, **options):
+        self.limit = options['top']
+        if options['url']:
+            entries = self.collect(options['url'])
+        else:
+            entries = slow_queries.top(self.limit)
+        if not entries:
+            self.stdout.write('Медленных запросов нет.')
+        warnings = 0
+        for number, entry in enumerate(entries, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{number}. ×{entry["count"]}, всего '
+                f'{entry["total_ms"]:.1f} мс, максимум '
+                f'{entry["max_ms"]:.1f} мс — {entry["view"]}, '
+                f'{entry["origin"] or "?"}'))
+            self.stdout.write(f'   {entry["fingerprint"]}')
+            try:
+                plan = slow_queries.explain(
+                    connection, entry['sql'],
+                    slow_queries.example_params(entry))
+            except DatabaseError as error:
+                self.stdout.write(self.style.ERROR(
+                    f'   План не получен: {error}'))
+                continue
+            for detail, warning in plan:
+                if warning:
+                    warnings += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'   ! {detail} ({warning})'))
+                else:
+                    self.stdout.write(f'     {detail}')
+        if warnings:
+            self.stdout.write(self.style.WARNING(
+                f'Подозрительных шагов в планах: {warnings}'))
+        if options['reset'] and not options['url']:
+            slow_queries.reset()
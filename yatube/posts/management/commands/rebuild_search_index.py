@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов.'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError(
+                'Полнотекстовый индекс поддерживается только для SQLite.')
+        with transaction.atomic():
+            indexed = search.rebuild(Post.objects.all())
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {indexed}'))
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пользователи, чьи ленты пересобрать (по умолчанию все).')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = get_user_model().objects.filter(
+                username__in=options['usernames'])
+        with transaction.atomic():
+            entries = timeline.rebuild(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Лент пересобрано, записей: {entries}'))
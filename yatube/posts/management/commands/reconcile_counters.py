@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики постов и авторов.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено строк со счётчиками: {fixed}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts import storage
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки, на которые не ссылается ни один пост и '
+            'которые не использовались POST_IMAGE_RELEASE_GRACE секунд.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        deleted = sum(storage.release(name, posts)
+                      for name in list(storage.orphans(posts)))
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено картинок: {deleted}'))
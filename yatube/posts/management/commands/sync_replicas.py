@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в файлы реплик DATABASE_REPLICAS — '
+        'замена настоящей репликации для проверки на одной машине.'
+    )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Копировать можно только базу SQLite.')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не настроены (DATABASE_REPLICAS).')
+        # Резервное копирование SQLite даёт целостный снимок даже во
+        # время записи, в отличие от копирования файла.
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(
+                    connections[alias].settings_dict['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Реплика {alias} обновлена'))
+        finally:
+            source.close()
@@ -0,0 +1,31 @@
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Создаёт недостающие миниатюры картинок всех постов '
+            '(например, после изменения POST_THUMBNAILS).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Число процессов, между которыми делятся картинки.')
+
+    def handle(self, *args, **options):
+        images = list(Post.objects.exclude(image='')
+                      .values_list('image', flat=True).distinct())
+        if options['processes'] > 1:
+            # Дочерние процессы не должны наследовать открытые соединения.
+            connections.close_all()
+            with Pool(options['processes']) as pool:
+                generated = sum(pool.imap_unordered(
+                    thumbnails.generate, images))
+        else:
+            generated = sum(map(thumbnails.generate, images))
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок: {len(images)}, миниатюр готово: {generated}'))
@@ -0,0 +1,219 @@
+"""
+Метрики в текстовом формате Prometheus.
+
+Счётчики и гистограммы копятся в памяти процесса. Если задан
+METRICS_DB, фоновый поток каждого процесса раз в METRICS_FLUSH_INTERVAL
+секунд прибавляет накопленное к итогам в общем файле SQLite, поэтому
+страница метрик показывает сумму по всем воркерам gunicorn, а ответы не
+ждут записи в файл. Без METRICS_DB метрики видны только в пределах
+процесса.
+"""
+
+import atexit
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# {(имя, метки, суффикс): значение} — прирост с последней записи в
+# METRICS_DB или, без неё, итог за жизнь процесса.
+_values = defaultdict(float)
+_metrics = {}
+# {(функция, pid): поток}: после fork потоки родителя не работают.
+_flushers = {}
+_flushers_lock = threading.Lock()
+
+
+def _labels_key(labels) -> str:
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def flush_in_background(flush) -> None:
+    """
+    Запускает в текущем процессе поток, который раз в
+    METRICS_FLUSH_INTERVAL секунд вызывает flush.
+    """
+    key = (flush, os.getpid())
+    if key in _flushers:
+        return
+    with _flushers_lock:
+        if key in _flushers:
+            return
+        thread = threading.Thread(target=_flush_loop, args=(flush,),
+                                  name=f'{flush.__module__}.flush',
+                                  daemon=True)
+        _flushers[key] = thread
+        thread.start()
+
+
+def _flush_loop(flush):
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _add(name, labels, suffix, value):
+    with _lock:
+        _values[(name, _labels_key(labels), suffix)] += value
+    if settings.METRICS_DB:
+        flush_in_background(flush)
+
+
+class Metric:
+    def __init__(self, name, help_text, kind='counter', buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.buckets = buckets
+        _metrics[name] = self
+
+    def inc(self, value=1, **labels) -> None:
+        if value:
+            _add(self.name, labels, '', value)
+
+    def observe(self, value, **labels) -> None:
+        bucket = next((le for le in self.buckets if value <= le), math.inf)
+        _add(self.name, labels, f'bucket:{bucket}', 1)
+        _add(self.name, labels, 'sum', value)
+        _add(self.name, labels, 'count', 1)
+
+
+REQUESTS = Metric('yatube_requests_total',
+                  'Ответы по имени URL, методу и статусу.')
+REQUEST_DURATION = Metric('yatube_request_duration_seconds',
+                          'Время ответа по имени URL.', 'histogram',
+                          DURATION_BUCKETS)
+REQUEST_QUERIES = Metric('yatube_request_queries',
+                         'Число SQL-запросов на ответ по имени URL.',
+                         'histogram', QUERY_BUCKETS)
+CACHE_LOOKUPS = Metric('yatube_cache_lookups_total',
+                       'Обращения к кешам: страниц, карточек, поиска и '
+                       'миниатюр, по имени URL и результату.')
+UPLOADS = Metric('yatube_uploads_total',
+                 'Загрузки файлов: принятые и отклонённые.')
+UPLOAD_BYTES = Metric('yatube_upload_bytes_total',
+                      'Объём принятых загрузок.')
+THUMBNAILS = Metric('yatube_thumbnails_generated_total',
+                    'Созданные варианты миниатюр.')
+THUMBNAIL_DURATION = Metric('yatube_thumbnail_duration_seconds',
+                            'Время создания всех миниатюр картинки.',
+                            'histogram', DURATION_BUCKETS)
+DOWNSIZED = Metric('yatube_images_downsized_total',
+                   'Уменьшенные слишком крупные оригиналы.')
+
+
+def _connect():
+    connection = sqlite3.connect(settings.METRICS_DB, timeout=10)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS metrics ('
+        'name TEXT, labels TEXT, suffix TEXT, value REAL, '
+        'PRIMARY KEY (name, labels, suffix))')
+    return connection
+
+
+def flush() -> None:
+    """
+    Прибавляет накопленное процессом к итогам в METRICS_DB. Если файл
+    недоступен, прирост возвращается в память до следующей попытки.
+    """
+    if not settings.METRICS_DB:
+        return
+    with _lock:
+        pending = list(_values.items())
+        _values.clear()
+    if not pending:
+        return
+    try:
+        connection = _connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO metrics (name, labels, suffix, value) '
+                    'VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, suffix) '
+                    'DO UPDATE SET value = value + excluded.value',
+                    [(*key, value) for key, value in pending])
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError):
+        logger.exception('Не удалось записать метрики в %s',
+                         settings.METRICS_DB)
+        with _lock:
+            for key, value in pending:
+                _values[key] += value
+
+
+def snapshot() -> dict:
+    """Текущие итоги: {(имя, метки, суффикс): значение}."""
+    if not settings.METRICS_DB:
+        with _lock:
+            return dict(_values)
+    flush()
+    connection = _connect()
+    try:
+        rows = connection.execute(
+            'SELECT name, labels, suffix, value FROM metrics').fetchall()
+    finally:
+        connection.close()
+    return {(name, labels, suffix): value
+            for name, labels, suffix, value in rows}
+
+
+def _format_labels(labels, **extra) -> str:
+    pairs = [*json.loads(labels), *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render() -> str:
+    """Метрики в текстовом формате Prometheus 0.0.4."""
+    series = defaultdict(dict)
+    for (name, labels, suffix), value in snapshot().items():
+        series[name].setdefault(labels, {})[suffix] = value
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f'# HELP {name} {metric.help_text}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, values in sorted(series[name].items()):
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} '
+                             f'{_format_value(values[""])}')
+                continue
+            cumulative = 0
+            for le in (*metric.buckets, math.inf):
+                cumulative += values.get(f'bucket:{le}', 0)
+                bound = '+Inf' if le == math.inf else le
+                lines.append(f'{name}_bucket{_format_labels(labels, le=bound)}'
+                             f' {_format_value(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labels)} '
+                         f'{_format_value(values.get("sum", 0))}')
+            lines.append(f'{name}_count{_format_labels(labels)} '
+                         f'{_format_value(values.get("count", 0))}')
+    return '\n'.join(lines) + '\n'
+
+
+@atexit.register
+def _flush_at_exit():
+    if settings.configured and getattr(settings, 'METRICS_DB', None):
+        flush()
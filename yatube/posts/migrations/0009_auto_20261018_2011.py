@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:11
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    # Без уникального ограничения подписка могла сохраниться дважды:
+    # оставляем по одной, самой ранней, иначе AddConstraint упадёт.
+    Follow = apps.get_model('posts', 'Follow')
+    first = (Follow.objects.values('user', 'author')
+             .annotate(first_id=Min('id')).values('first_id'))
+    Follow.objects.exclude(id__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_follow'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['pub_date', 'id'], name='post_pub_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'pub_date', 'id'], name='post_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', 'pub_date', 'id'], name='post_group_pub_date_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_follows,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from posts.search import SEARCH_TABLE, tokenize
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(body)')
+    for post_id, text in Post.objects.values_list('id', 'text').iterator():
+        schema_editor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (%s, %s)',
+            [post_id, ' '.join(tokenize(text))])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_post_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
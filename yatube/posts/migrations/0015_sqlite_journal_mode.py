@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations
+
+from posts.sqlite import set_journal_mode
+
+
+def enable_journal_mode(apps, schema_editor):
+    set_journal_mode(schema_editor.connection, settings.SQLITE_JOURNAL_MODE)
+
+
+def restore_journal_mode(apps, schema_editor):
+    set_journal_mode(schema_editor.connection, 'DELETE')
+
+
+class Migration(migrations.Migration):
+    # Режим журнала нельзя сменить внутри транзакции.
+    atomic = False
+
+    dependencies = [
+        ('posts', '0014_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_journal_mode, restore_journal_mode),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 NUM_CHARS_POST_STR = 15
 
@@ -9,11 +11,26 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
 
     def __str__(self) -> str:
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """
+        Выборка для лент постов: автор и группа подтягиваются одним JOIN,
+        а неиспользуемые в карточке поста колонки не загружаются.
+        """
+        return self.select_related('author', 'group').only(
+            'id', 'text', 'pub_date', 'updated', 'image', 'author_id',
+            'group_id', 'comments_count',
+            'author__username', 'author__first_name', 'author__last_name',
+            'group__title', 'group__slug',
+        )
+
+
 class Post(models.Model):
     text = models.TextField(
         'Текст поста',
@@ -22,6 +39,9 @@ class Post(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True)
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -37,14 +57,32 @@ class Post(models.Model):
         verbose_name='Группа',
         help_text='Группа, к которой будет относиться пост'
     )
+    # Одинаковые картинки хранятся одним файлом (см. posts.storage),
+    # индекс нужен для проверки, ссылается ли на файл ещё кто-то.
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        db_index=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date', '-id']
+        # Индексы повторяют форму запросов лент: сортировка по
+        # (-pub_date, -id) и фильтр по автору или группе.
+        indexes = [
+            models.Index(fields=['pub_date', 'id'],
+                         name='post_pub_date_id_idx'),
+            models.Index(fields=['author', 'pub_date', 'id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', 'pub_date', 'id'],
+                         name='post_group_pub_date_idx'),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
@@ -76,6 +114,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -88,3 +130,49 @@ class Follow(models.Model):
         User, on_delete=models.CASCADE, related_name='follower')
     author = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='following')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    Материализованная лента подписок: пост автора, разложенный
+    по лентам его подписчиков в момент публикации.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Копия Post.pub_date, чтобы лента читалась одним проходом по индексу.
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-post_id']
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_entry'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счётчики пользователя (см. posts.counters)."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='stats')
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
@@ -0,0 +1,228 @@
+"""
+Паджинация лент постов по ключу сортировки (keyset/cursor pagination).
+
+Вместо COUNT(*) и OFFSET n страница выбирается одним диапазонным запросом
+по полям Meta.ordering модели, поэтому глубокие страницы не замедляются
+с ростом таблицы. Паджинатору по номерам страниц (CountedPaginator)
+размер ленты передаётся готовым — из счётчиков, а не из COUNT(*).
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    """Курсор из GET-параметра не удалось разобрать."""
+
+
+class KeysetPaginator(Paginator):
+    """
+    Паджинатор, переходящий между страницами по курсору.
+
+    Курсор хранит номер страницы, направление и значения полей сортировки
+    крайнего поста соседней страницы. Общее число постов неизвестно,
+    поэтому num_pages и count — нижние оценки, достаточные для работы
+    стандартного Page (has_next, next_page_number и т.д.).
+    """
+
+    keyset = True
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True):
+        super().__init__(object_list, per_page, orphans,
+                         allow_empty_first_page)
+        self.ordering = list(
+            object_list.query.order_by or object_list.model._meta.ordering
+        )
+        self.number = 1
+        self.has_more = False
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._page_len = 0
+
+    @property
+    def num_pages(self):
+        return self.number + 1 if self.has_more else self.number
+
+    @property
+    def count(self):
+        return ((self.number - 1) * self.per_page + self._page_len
+                + int(self.has_more))
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-'))
+                for name in self.ordering]
+
+    def encode_cursor(self, number, forward, obj):
+        values = [
+            obj._meta.get_field(name).value_to_string(obj)
+            for name, _ in self._fields()
+        ]
+        raw = json.dumps([number, forward, values]).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            number, forward, values = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()))
+            # Ключ — значение каждого поля сортировки; с None фильтр
+            # в _seek не построить.
+            if (not isinstance(values, list)
+                    or len(values) != len(self._fields())
+                    or None in values):
+                raise InvalidCursor(cursor)
+            model = self.object_list.model
+            key = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self._fields(), values)
+            ]
+        except (ValueError, TypeError, AttributeError, ValidationError):
+            raise InvalidCursor(cursor)
+        if (not isinstance(number, int) or number < 1
+                or None in key):
+            raise InvalidCursor(cursor)
+        return number, bool(forward), key
+
+    def _seek(self, key, forward):
+        """Условие «строго после key» (или «до», если forward=False)."""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self._fields(), key):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _reverse_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering]
+
+    def get_page(self, cursor=None, number=None):
+        """
+        Возвращает страницу по курсору. Без курсора поддерживается
+        номер страницы из старых ссылок ?page=N: такая страница
+        выбирается через OFFSET, но всё так же без COUNT.
+        """
+        limit = self.per_page + 1
+        queryset = self.object_list
+        try:
+            self.number, forward, key = self.decode_cursor(cursor)
+        except InvalidCursor:
+            self.number, forward, key = 1, True, None
+            try:
+                self.number = max(int(number), 1)
+            except (TypeError, ValueError):
+                pass
+        if key is None:
+            offset = (self.number - 1) * self.per_page
+            rows = list(queryset[offset:offset + limit])
+        elif forward:
+            rows = list(queryset.filter(self._seek(key, True))[:limit])
+        else:
+            rows = list(queryset.filter(self._seek(key, False))
+                        .order_by(*self._reverse_ordering())[:limit])
+            if len(rows) < limit:
+                # Перед страницей меньше постов, чем на ней помещается:
+                # это начало ленты, отдаём честную первую страницу.
+                self.number = 1
+                rows = list(queryset[:limit])
+            else:
+                # Следующая страница заведомо есть — с неё мы и пришли.
+                rows = rows[self.per_page - 1::-1] + rows[:1]
+        self.has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        self._page_len = len(rows)
+        if rows and self.has_more:
+            self.next_cursor = self.encode_cursor(
+                self.number + 1, True, rows[-1])
+        if rows and self.number > 1:
+            self.previous_cursor = self.encode_cursor(
+                self.number - 1, False, rows[0])
+        return Page(rows, self.number, self)
+
+
+class CountedPaginator(Paginator):
+    """
+    Паджинатор по номерам страниц, получающий число объектов от функции
+    total (обычно из денормализованных счётчиков) вместо COUNT(*).
+
+    total может быть оценкой, например из кеша другого воркера. Если
+    запрошенная страница оказалась пустой или за концом выборки, или на
+    последней странице нашлась строка за пределами total, паджинатор
+    один раз считает объекты честно, передаёт число в on_exact и
+    отдаёт страницу заново.
+    """
+
+    def __init__(self, object_list, per_page, total, on_exact=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.total = total
+        self.on_exact = on_exact
+        self.exact = False
+
+    @cached_property
+    def count(self):
+        return self.total()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # Ссылку на страницу дальше оценки мог выдать воркер,
+            # у которого total точнее.
+            if self.exact or int(number) < 1:
+                raise
+            self._recount()
+            return super().validate_number(number)
+
+    def page(self, number):
+        page = super().page(number)
+        page.object_list = list(page.object_list)
+        if self.exact:
+            return page
+        if not page.object_list and page.number > 1:
+            self._recount()
+            return self.page(min(page.number, self.num_pages))
+        # Заниженный total обрезал бы последнюю страницу и прятал
+        # следующие; проверка стоит одного LIMIT 1 только на ней.
+        if (page.number == self.num_pages
+                and self.object_list[self.count:self.count + 1].exists()):
+            self._recount()
+            return self.page(page.number)
+        return page
+
+    def _recount(self):
+        self.count = self.object_list.count()
+        self.exact = True
+        self.__dict__.pop('num_pages', None)
+        if self.on_exact:
+            self.on_exact(self.count)
+
+
+def page_window(page, neighbours=2) -> list:
+    """
+    Номера страниц для навигации: первая, последняя и neighbours
+    соседних с текущей с каждой стороны; пропуски обозначены None.
+    Например, для 50-й страницы из 100: [1, None, 48, 49, 50, 51, 52,
+    None, 100]. Длина списка не зависит от числа страниц.
+    """
+    last = page.paginator.num_pages
+    start = max(page.number - neighbours, 1)
+    end = min(page.number + neighbours, last)
+    pages = []
+    if start > 1:
+        pages.append(1)
+        # Вместо многоточия на месте одной страницы показывается она сама.
+        if start > 2:
+            pages.append(2 if start == 3 else None)
+    pages.extend(range(start, end + 1))
+    if end < last:
+        if end < last - 1:
+            pages.append(last - 1 if end == last - 2 else None)
+        pages.append(last)
+    return pages
@@ -0,0 +1,183 @@
+"""
+Профилирование запросов.
+
+ProfilingMiddleware собирает по каждому запросу время и число SQL-
+запросов, время отрисовки шаблонов, попадания в кеши и работу с
+миниатюрами и отдаёт их в заголовке Server-Timing (его показывают
+инструменты разработчика в браузере). Доля запросов PROFILING_SAMPLE_RATE
+целиком записывается cProfile в PROFILING_DIR для разбора через pstats
+или snakeviz.
+
+Код приложения отчитывается через count() и timed(); вне запроса они
+ничего не делают. Итоги каждого запроса попадают и в метрики (metrics),
+а запросы к базе дольше SLOW_QUERY_MS — в журнал slow_queries.
+"""
+
+import cProfile
+import os
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from . import metrics, slow_queries
+
+_current = ContextVar('request_stats', default=None)
+
+# Счётчики попаданий в кеши: имя в Server-Timing -> (попадания, промахи).
+CACHE_COUNTERS = {
+    'page': ('page_hits', 'page_misses'),
+    'cards': ('card_hits', 'card_misses'),
+    'search': ('search_hits', 'search_misses'),
+    'thumbs': ('thumbnail_hits', 'thumbnail_misses'),
+}
+
+
+class RequestStats:
+    def __init__(self, request=None):
+        self.request = request
+        self.counters = Counter()
+        self.timings = Counter()
+        self.running = set()
+
+    @property
+    def view_name(self) -> str:
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match else 'unresolved'
+
+    def server_timing(self, total) -> str:
+        entries = [
+            f'db;dur={self.timings["db"]:.1f};'
+            f'desc="{self.counters["queries"]} queries"',
+            f'tpl;dur={self.timings["template"]:.1f}',
+        ]
+        if self.timings['thumbnails']:
+            entries.append(f'thumbgen;dur={self.timings["thumbnails"]:.1f}')
+        for name, (hits, misses) in CACHE_COUNTERS.items():
+            if self.counters[hits] or self.counters[misses]:
+                entries.append(f'{name};desc="hits={self.counters[hits]} '
+                               f'misses={self.counters[misses]}"')
+        entries.append(f'total;dur={total:.1f}')
+        return ', '.join(entries)
+
+
+def count(name, value=1) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.counters[name] += value
+
+
+@contextmanager
+def timed(name):
+    """Добавляет время блока к name; вложенные замеры не суммируются."""
+    stats = _current.get()
+    if stats is None or name in stats.running:
+        yield
+        return
+    stats.running.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.timings[name] += (time.perf_counter() - started) * 1000
+        stats.running.discard(name)
+
+
+def _record_query(stats, execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        stats.timings['db'] += elapsed
+        stats.counters['queries'] += 1
+        if elapsed >= settings.SLOW_QUERY_MS:
+            slow_queries.record(sql, params, elapsed, stats.view_name)
+
+
+def _dump_name(request, total) -> str:
+    path = re.sub(r'[^\w-]+', '_', request.path).strip('_') or 'root'
+    return (f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-'
+            f'{path[:80]}-{total:.0f}ms.prof')
+
+
+def record_metrics(request, response, stats, total) -> None:
+    view = stats.view_name
+    metrics.REQUESTS.inc(view=view, method=request.method,
+                         status=response.status_code)
+    metrics.REQUEST_DURATION.observe(total / 1000, view=view)
+    metrics.REQUEST_QUERIES.observe(stats.counters['queries'], view=view)
+    for name, (hits, misses) in CACHE_COUNTERS.items():
+        metrics.CACHE_LOOKUPS.inc(stats.counters[hits], cache=name,
+                                  view=view, result='hit')
+        metrics.CACHE_LOOKUPS.inc(stats.counters[misses], cache=name,
+                                  view=view, result='miss')
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        profiler = None
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        lambda *args: _record_query(stats, *args)))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            _current.reset(token)
+        total = (time.perf_counter() - started) * 1000
+
+        # cache_page помечает GET-запрос: False — ответ взят из кеша.
+        cached = getattr(request, '_cache_update_cache', None)
+        if cached is not None and request.method in ('GET', 'HEAD'):
+            stats.counters['page_misses' if cached else 'page_hits'] += 1
+        record_metrics(request, response, stats, total)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = stats.server_timing(total)
+        if profiler:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(
+                settings.PROFILING_DIR, _dump_name(request, total)))
+        return response
+
+
+class ProfiledTemplate:
+    """Шаблон, время отрисовки которого попадает в статистику запроса."""
+
+    def __init__(self, template):
+        self._wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self._wrapped.render(context, request)
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name))
@@ -0,0 +1,85 @@
+"""
+Чтение с реплик.
+
+ReplicaRouter отправляет запись в основную базу, а чтение — на одну из
+реплик DATABASE_REPLICAS. Чтобы пользователь сразу видел свой пост,
+комментарий или подписку, запрос, который что-то записал, получает от
+ReplicaPinMiddleware cookie, и REPLICA_PIN_SECONDS секунд все его
+запросы читают из основной базы; там же читают остаток такого запроса и
+всё, что выполняется внутри транзакции. Страницы лент, поколение
+которых только что сменилось, отрисовываются для кеша по основной базе
+(read_primary, см. posts.caching.cache_feed): иначе отстающая реплика
+закрепила бы устаревшую страницу в кеше на всё время его жизни.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'read_primary'
+
+_pin = ContextVar('replica_pin', default=None)
+
+
+class Pin:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def read_primary():
+    """Внутри блока все чтения идут в основную базу."""
+    outer = _pin.get()
+    pin = Pin(pinned=True)
+    token = _pin.set(pin)
+    try:
+        yield
+    finally:
+        _pin.reset(token)
+        if outer is not None and pin.wrote:
+            outer.wrote = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        pin = _pin.get()
+        if (not settings.DATABASE_REPLICAS
+                or pin is not None and (pin.pinned or pin.wrote)
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        pin = _pin.get()
+        if pin is not None:
+            pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной базе.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin = Pin(pinned=PIN_COOKIE in request.COOKIES)
+        token = _pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pin.reset(token)
+        if pin.wrote:
+            response.set_cookie(PIN_COOKIE, '1',
+                                max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,256 @@
+"""
+Полнотекстовый поиск по постам.
+
+Текст поста разбивается на слова, русские слова приводятся к основе
+стеммером Snowball, и основы складываются в виртуальную таблицу SQLite
+FTS5 posts_post_search (rowid = id поста). Запрос проходит ту же
+обработку, а результаты ранжируются функцией bm25. Индекс обновляется
+сигналами при создании, редактировании и удалении поста; на других СУБД
+поиск откатывается к text__icontains.
+"""
+
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.db import connection
+
+from . import caching, profiling
+
+SEARCH_TABLE = 'posts_post_search'
+# Больше результатов не ранжируется и не показывается: счётчик выдачи
+# превращается в «больше N».
+SEARCH_RESULTS_LIMIT = 1000
+SEARCH_CACHE_TIME = 60 * 10
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile('[а-я]')
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    ('вшись', True), ('вши', True), ('в', True),
+    ('ившись', False), ('ывшись', False), ('ивши', False), ('ывши', False),
+    ('ив', False), ('ыв', False),
+)
+ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей',
+    'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею',
+)
+PARTICIPLE = (
+    ('ивш', False), ('ывш', False), ('ующ', False),
+    ('ем', True), ('нн', True), ('вш', True), ('ющ', True), ('щ', True),
+)
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ейте', False), ('уйте', False), ('ила', False), ('ыла', False),
+    ('ена', False), ('ите', False), ('или', False), ('ыли', False),
+    ('ило', False), ('ыло', False), ('ено', False), ('ует', False),
+    ('уют', False), ('ены', False), ('ить', False), ('ыть', False),
+    ('ишь', False), ('ей', False), ('уй', False), ('ил', False),
+    ('ыл', False), ('им', False), ('ым', False), ('ен', False),
+    ('ят', False), ('ит', False), ('ыт', False), ('ую', False),
+    ('ю', False),
+    ('ете', True), ('йте', True), ('ешь', True), ('нно', True),
+    ('ла', True), ('на', True), ('ли', True), ('ем', True), ('ло', True),
+    ('но', True), ('ет', True), ('ют', True), ('ны', True), ('ть', True),
+    ('й', True), ('л', True), ('н', True),
+)
+NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие',
+    'ье', 'еи', 'ии', 'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях',
+    'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю',
+    'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _region(word, start=0):
+    """Начало области после первой пары «гласная + согласная»."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(rv, endings):
+    """Отрезает самое длинное подходящее окончание (ending, after_a_ya)."""
+    for ending, after_a_ya in sorted(endings, key=lambda e: -len(e[0])):
+        if rv.endswith(ending):
+            stem = rv[:-len(ending)]
+            if not after_a_ya or stem.endswith(('а', 'я')):
+                return stem
+    return None
+
+
+def _strip_or_keep(rv, endings):
+    stripped = _strip(rv, endings)
+    return rv if stripped is None else stripped
+
+
+def _plain(endings):
+    return [(ending, False) for ending in endings]
+
+
+def stem(word: str) -> str:
+    """Стеммер Snowball для русского языка."""
+    word = word.lower().replace('ё', 'е')
+    rv_start = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r2_start = _region(word, _region(word))
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратность и прилагательное,
+    # глагол или существительное.
+    stripped = _strip(rv, PERFECTIVE_GERUND)
+    if stripped is not None:
+        rv = stripped
+    else:
+        rv = _strip_or_keep(rv, _plain(REFLEXIVE))
+        adjective = _strip(rv, _plain(ADJECTIVE))
+        verb = _strip(rv, VERB)
+        if adjective is not None:
+            rv = _strip_or_keep(adjective, PARTICIPLE)
+        elif verb is not None:
+            rv = verb
+        else:
+            rv = _strip_or_keep(rv, _plain(NOUN))
+    # Шаг 2.
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    # Шаг 3: словообразовательное окончание в области R2.
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and (
+                rv_start + len(rv) - len(ending) >= r2_start):
+            rv = rv[:-len(ending)]
+            break
+    # Шаг 4.
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, _plain(SUPERLATIVE))
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') \
+                else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text: str) -> list:
+    """Разбивает текст на слова и приводит русские слова к основе."""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) if CYRILLIC_RE.search(word) else word
+            for word in words]
+
+
+def is_available() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def index_post(post) -> None:
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (%s, %s)',
+            [post.pk, ' '.join(tokenize(post.text))])
+
+
+def remove_post(post_id) -> None:
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild(posts) -> int:
+    """Перестраивает индекс по переданным постам, возвращает их число."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        rows = [(post_id, ' '.join(tokenize(text)))
+                for post_id, text in posts.values_list('id', 'text')]
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (%s, %s)',
+            rows)
+    caching.bump(caching.FEED)
+    return len(rows)
+
+
+def match_expression(query: str) -> str:
+    """
+    Строит выражение MATCH: все основы запроса обязательны, каждая
+    совпадает как префикс. Основы берутся в кавычки, поэтому операторы
+    FTS5 из пользовательского ввода не интерпретируются.
+    """
+    return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+
+class RankedResults:
+    """
+    Найденные посты в порядке релевантности.
+
+    Хранит только список id (не больше SEARCH_RESULTS_LIMIT), поэтому
+    число результатов известно без COUNT, а срез для страницы выдачи
+    загружает лишь посты этой страницы по первичному ключу.
+    """
+
+    def __init__(self, queryset, ids, capped):
+        self.queryset = queryset
+        self.ids = ids
+        self.capped = capped
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        ids = self.ids[index]
+        posts = self.queryset.in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def ranked_ids(expression: str) -> tuple:
+    """
+    id постов, подходящих под выражение, по убыванию релевантности,
+    и признак того, что выдача обрезана. Результат кешируется до
+    следующего изменения постов.
+    """
+    generation = caching.get_generations(caching.FEED)[0]
+    digest = hashlib.md5(expression.encode()).hexdigest()
+    key = f'search:{generation}:{digest}'
+    result = cache.get(key)
+    profiling.count('search_misses' if result is None else 'search_hits')
+    if result is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [expression, SEARCH_RESULTS_LIMIT + 1])
+            ids = [row[0] for row in cursor.fetchall()]
+        result = (ids[:SEARCH_RESULTS_LIMIT], len(ids) > SEARCH_RESULTS_LIMIT)
+        cache.set(key, result, SEARCH_CACHE_TIME)
+    return result
+
+
+def search(queryset, query: str):
+    """
+    Возвращает посты из queryset, подходящие под запрос, по
+    релевантности.
+    """
+    if not is_available():
+        return queryset.filter(text__icontains=query)
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    ids, capped = ranked_ids(expression)
+    return RankedResults(queryset, ids, capped)
@@ -0,0 +1,168 @@
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from . import caching, counters, search, storage, timeline
+from .models import Comment, Follow, Group, Post
+
+# id постов, которые сейчас удаляются: комментарии удаляются каскадом
+# раньше поста, и их счётчик и страницы обновлять незачем — всё это
+# сделают сигналы самого поста.
+_deleting_posts = ContextVar('deleting_posts', default=frozenset())
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleting_post(sender, instance, **kwargs):
+    _deleting_posts.set(_deleting_posts.get() | {instance.pk})
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleting_post(sender, instance, **kwargs):
+    _deleting_posts.set(_deleting_posts.get() - {instance.pk})
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created and timeline.is_enabled():
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created and timeline.is_enabled():
+        timeline.backfill(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    if timeline.is_enabled():
+        timeline.trim(instance.user, instance.author)
+
+
+@receiver(post_init, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    # Берём значение из __dict__, чтобы не подгружать отложенное поле.
+    instance._initial_group_id = instance.__dict__.get('group_id')
+    image = instance.__dict__.get('image')
+    instance._initial_image = getattr(image, 'name', image)
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    # Должен выполниться до invalidate_post_pages, которая обновляет
+    # _initial_group_id: порядок задаётся порядком объявления.
+    if created:
+        counters.change_author(instance.author_id, 1, 'posts_count')
+        counters.change_group(instance.group_id, 1)
+        counters.change_feed(1)
+        counters.forget_follower_totals(instance.author_id)
+    elif instance.group_id != instance._initial_group_id:
+        counters.change_group(instance._initial_group_id, -1)
+        counters.change_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, -1, 'posts_count')
+    counters.change_group(instance.group_id, -1)
+    counters.change_feed(-1)
+    counters.forget_follower_totals(instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    if instance.post_id not in _deleting_posts.get():
+        counters.change_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_author(instance.author_id, 1, 'followers_count')
+        counters.change_author(instance.user_id, 1, 'following_count')
+        counters.forget_follow_total(instance.user_id)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, -1, 'followers_count')
+    counters.change_author(instance.user_id, -1, 'following_count')
+    counters.forget_follow_total(instance.user_id)
+
+
+def post_scopes(post):
+    group_ids = {post.group_id, getattr(post, '_initial_group_id', None)}
+    group_ids.discard(None)
+    slugs = Group.objects.filter(
+        id__in=group_ids).values_list('slug', flat=True) if group_ids else ()
+    return [
+        caching.FEED,
+        caching.author_scope(post.author.username),
+        *map(caching.group_scope, slugs),
+    ]
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    caching.bump(*post_scopes(instance))
+    instance._initial_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    if instance.post_id not in _deleting_posts.get():
+        caching.bump(*post_scopes(instance.post))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_pages(sender, instance, **kwargs):
+    caching.bump(caching.GROUPS, caching.group_scope(instance.slug))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_profile_page(sender, instance, **kwargs):
+    # Профиль автора показывает число подписчиков, профиль
+    # подписчика — число подписок.
+    caching.bump(caching.author_scope(instance.author.username),
+                 caching.author_scope(instance.user.username))
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_text(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+def release_image(image_name):
+    transaction.on_commit(
+        lambda: storage.release(image_name, Post.objects.all()))
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, created, **kwargs):
+    if instance._initial_image and (
+            instance._initial_image != instance.image.name):
+        release_image(instance._initial_image)
+    instance._initial_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    release_image(instance.image.name)
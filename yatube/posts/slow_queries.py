@@ -0,0 +1,211 @@
+"""
+Журнал медленных SQL-запросов.
+
+ProfilingMiddleware передаёт в record() каждый запрос дольше
+SLOW_QUERY_MS вместе с именем URL и местом в коде проекта, откуда он
+выполнен. Запросы группируются по отпечатку — тексту без конкретных
+значений, поэтому запросы N+1 складываются в одну строку. Каждый
+запрос пишется в лог, а сводка копится в памяти процесса и, если задан
+SLOW_QUERY_DB, фоновым потоком раз в METRICS_FLUSH_INTERVAL секунд
+добавляется в общий для воркеров файл SQLite. Значения параметров
+запросов (ключи сессий, хеши паролей) в файл не пишутся: они остаются
+в памяти процесса, а EXPLAIN для сводки из файла получает NULL.
+Команда explain_queries показывает планы самых затратных запросов.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import traceback
+
+from django.conf import settings
+
+from .metrics import flush_in_background
+
+FINGERPRINT_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b|%s")
+IN_LIST_RE = re.compile(r'\(\?(?:, \?)+\)')
+# Строки плана EXPLAIN QUERY PLAN, которые стоит показать: полный
+# проход по таблице (не по индексу и не поиск FTS5) и сортировка или
+# группировка во временном B-дереве.
+PLAN_WARNINGS = (
+    (re.compile(r'^SCAN (?!.*\b(?:USING|VIRTUAL TABLE|CONSTANT ROW)\b)'),
+     'полный проход по таблице'),
+    (re.compile(r'USE TEMP B-TREE'), 'сортировка во временном B-дереве'),
+)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_entries = {}
+
+
+def fingerprint(sql) -> str:
+    """SQL без конкретных значений: одинаковый для запросов N+1."""
+    return IN_LIST_RE.sub('(...)', FINGERPRINT_RE.sub('?', sql))
+
+
+def origin() -> str:
+    """Ближайший к запросу кадр стека из кода проекта, а не Django."""
+    root = str(settings.BASE_DIR)
+    skip = (os.path.abspath(__file__),
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'profiling.py'))
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(root) and filename not in skip
+                and 'site-packages' not in filename):
+            return (f'{os.path.relpath(filename, root)}:{frame.lineno} '
+                    f'{frame.name}')
+    return ''
+
+
+def record(sql, params, ms, view) -> None:
+    """Учитывает запрос, выполнявшийся ms миллисекунд."""
+    where = origin()
+    logger.warning('Медленный запрос %.1f мс в %s (%s): %s',
+                   ms, view, where, sql)
+    with _lock:
+        _merge(fingerprint(sql), {
+            'count': 1, 'total_ms': ms, 'max_ms': ms, 'sql': sql,
+            'params': json.dumps(list(params or ()), default=str),
+            'view': view, 'origin': where})
+    if settings.SLOW_QUERY_DB:
+        flush_in_background(flush)
+
+
+def _merge(key, entry):
+    """Добавляет entry к сводке; вызывается под _lock."""
+    current = _entries.get(key)
+    if current is None:
+        _entries[key] = dict(entry)
+        return
+    current['count'] += entry['count']
+    current['total_ms'] += entry['total_ms']
+    if entry['max_ms'] >= current['max_ms']:
+        # Пример для EXPLAIN — самый медленный из запросов.
+        current.update({name: entry[name] for name in (
+            'max_ms', 'sql', 'params', 'view', 'origin')})
+
+
+def _connect():
+    connection = sqlite3.connect(settings.SLOW_QUERY_DB, timeout=10)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS slow_queries ('
+        'fingerprint TEXT PRIMARY KEY, count INTEGER, total_ms REAL, '
+        'max_ms REAL, sql TEXT, params TEXT, view TEXT, origin TEXT)')
+    return connection
+
+
+def flush() -> None:
+    """
+    Добавляет сводку процесса в SLOW_QUERY_DB. Если файл недоступен,
+    сводка возвращается в память до следующей попытки.
+    """
+    if not settings.SLOW_QUERY_DB:
+        return
+    with _lock:
+        pending = list(_entries.items())
+        _entries.clear()
+    if not pending:
+        return
+    # Пример запроса и его место в коде берутся от самого медленного.
+    newer = ('CASE WHEN excluded.max_ms >= max_ms '
+             'THEN excluded.{0} ELSE {0} END')
+    try:
+        connection = _connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO slow_queries '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (fingerprint) DO UPDATE SET '
+                    'count = count + excluded.count, '
+                    'total_ms = total_ms + excluded.total_ms, '
+                    + ', '.join(f'{column} = {newer.format(column)}'
+                                for column in ('sql', 'view', 'origin'))
+                    + ', max_ms = max(max_ms, excluded.max_ms)',
+                    [(key, entry['count'], entry['total_ms'],
+                      entry['max_ms'], entry['sql'], None,
+                      entry['view'], entry['origin'])
+                     for key, entry in pending])
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError):
+        logger.exception('Не удалось записать сводку медленных запросов '
+                         'в %s', settings.SLOW_QUERY_DB)
+        with _lock:
+            for key, entry in pending:
+                _merge(key, entry)
+
+
+def top(limit=10) -> list:
+    """Самые затратные по суммарному времени отпечатки."""
+    if not settings.SLOW_QUERY_DB:
+        with _lock:
+            entries = [{'fingerprint': key, **entry}
+                       for key, entry in _entries.items()]
+        entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return entries[:limit]
+    flush()
+    connection = _connect()
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            'SELECT * FROM slow_queries ORDER BY total_ms DESC LIMIT ?',
+            [limit]).fetchall()
+    finally:
+        connection.close()
+    return [dict(row) for row in rows]
+
+
+def reset() -> None:
+    with _lock:
+        _entries.clear()
+    if settings.SLOW_QUERY_DB:
+        connection = _connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM slow_queries')
+        finally:
+            connection.close()
+
+
+def example_params(entry) -> list:
+    """
+    Параметры примера запроса для EXPLAIN: из памяти процесса или, для
+    сводки из SLOW_QUERY_DB, NULL вместо каждого значения.
+    """
+    if entry.get('params'):
+        return json.loads(entry['params'])
+    return [None] * entry['sql'].count('%s')
+
+
+def explain(connection, sql, params) -> list:
+    """
+    План запроса: [(строка плана, предупреждение или None)]. Запросы,
+    кроме SELECT, не разбираются — EXPLAIN их не выполняет, но и пользы
+    от их плана мало.
+    """
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        rows = cursor.fetchall()
+    plan = []
+    for row in rows:
+        detail = row[-1]
+        warning = next((message for pattern, message in PLAN_WARNINGS
+                        if pattern.search(detail)), None)
+        plan.append((detail, warning))
+    return plan
+
+
+@atexit.register
+def _flush_at_exit():
+    if settings.configured and getattr(settings, 'SLOW_QUERY_DB', None):
+        flush()
@@ -0,0 +1,52 @@
+"""
+Настройка соединений с SQLite.
+
+Каждое новое соединение получает SQLITE_PRAGMAS: synchronous=NORMAL (в
+режиме WAL целостность сохраняется, а fsync нужен только на
+контрольных точках), отображение файла в память, кеш страниц и
+ожидание блокировки вместо ошибки «database is locked». С CONN_MAX_AGE
+соединение вместе с кешем страниц живёт между запросами воркера, и
+прагмы применяются однажды.
+
+Режим журнала хранится в самом файле базы, поэтому он не входит в
+прагмы соединения: WAL, при котором читатели не ждут писателей,
+включает миграция 0015 (set_journal_mode). Переключать режим из каждого
+нового соединения значит брать для этого монопольную блокировку.
+
+Сравнить пропускную способность чтения при одновременной записи с
+настройками SQLite по умолчанию можно командой bench_sqlite.
+"""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def apply_pragmas(connection, pragmas) -> None:
+    """
+    Применяет прагмы к соединению модуля sqlite3. busy_timeout идёт
+    первым: остальные прагмы тоже могут ждать блокировку.
+    """
+    for name, value in sorted(pragmas.items(),
+                              key=lambda item: item[0] != 'busy_timeout'):
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+def set_journal_mode(connection, mode) -> str:
+    """
+    Переключает режим журнала базы соединения Django и возвращает
+    установленный режим. Вызывается вне транзакции.
+    """
+    if connection.vendor != 'sqlite':
+        return ''
+    connection.ensure_connection()
+    return connection.connection.execute(
+        f'PRAGMA journal_mode = {mode}').fetchone()[0]
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    # Прагмы идут мимо курсора Django: они не должны попадать ни в
+    # счётчики запросов, ни в журнал медленных запросов.
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection.connection, settings.SQLITE_PRAGMAS)
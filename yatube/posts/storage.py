@@ -0,0 +1,164 @@
+"""
+Хранилище картинок постов с адресацией по содержимому.
+
+Файл сохраняется под именем из SHA-256 его содержимого, поэтому
+повторная загрузка той же картинки не создаёт новый файл и новые
+миниатюры: у совпадающих картинок совпадают имена, а значит, и ключи
+миниатюр sorl. Файл и его миниатюры удаляются, когда на него не
+ссылается ни один пост (release()).
+
+Новый пост может взять уже лежащий файл, пока другой запрос удаляет
+последний ссылавшийся на него пост. Поэтому повторное использование
+файла в _save и проверка ссылок с удалением в release() идут под общей
+для процессов блокировкой, а использование обновляет время изменения
+файла: пост, который ещё не сохранён, не виден release(), и файл,
+тронутый за последние POST_IMAGE_RELEASE_GRACE секунд, не удаляется.
+Оставшиеся без постов файлы удаляет команда sweep_images.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.db import router
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+HASH_CHUNK_SIZE = 64 * 1024
+LOCK_NAME = '.release.lock'
+
+logger = logging.getLogger(__name__)
+
+_thread_lock = threading.Lock()
+
+
+def content_digest(content) -> str:
+    """SHA-256 файла, прочитанного кусками; позиция чтения сбрасывается."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked(storage):
+    """
+    Блокировка файла LOCK_NAME в каталоге хранилища, общая для
+    процессов; без fcntl — только между потоками процесса.
+    """
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(storage.location, exist_ok=True)
+        with open(os.path.join(storage.location, LOCK_NAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Имя всё равно заменит _save, а одинаковое содержимое
+        # и должно попадать в один файл.
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        digest = content_digest(content)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], digest + extension)
+        # Запись тоже под блокировкой: иначе две одинаковые загрузки
+        # обе пройдут проверку, и вторая в super()._save получит
+        # FileExistsError, а get_available_name вернёт то же имя —
+        # цикл повторов в FileSystemStorage не закончится.
+        with _locked(self):
+            if self.exists(name):
+                # Отметка для release(): файл снова нужен.
+                os.utime(self.path(name))
+                return name
+            return super()._save(name, content)
+
+
+def _idle_seconds(storage, name) -> float:
+    """Сколько секунд файл не использовался; у пропавшего — бесконечно."""
+    try:
+        return time.time() - os.path.getmtime(storage.path(name))
+    except FileNotFoundError:
+        return float('inf')
+
+
+def release(image_name, queryset, grace=None) -> bool:
+    """
+    Удаляет файл картинки и его миниатюры, если на него больше не
+    ссылается ни одна строка queryset и его не использовали последние
+    grace секунд (по умолчанию POST_IMAGE_RELEASE_GRACE). Возвращает,
+    удалён ли файл.
+    """
+    if not image_name:
+        return False
+    if grace is None:
+        grace = settings.POST_IMAGE_RELEASE_GRACE
+    # Ссылки проверяются в основной базе: реплика может ещё не знать о
+    # новом посте с той же картинкой.
+    primary = router.db_for_write(queryset.model)
+    field = queryset.model._meta.get_field('image')
+    image = ImageFile(image_name, field.storage)
+    try:
+        with _locked(field.storage):
+            if queryset.using(primary).filter(image=image_name).exists():
+                return False
+            if _idle_seconds(field.storage, image_name) < grace:
+                return False
+            default.kvstore.delete(image)
+            image.delete()
+    except (OSError, SuspiciousFileOperation):
+        # Пост уже удалён: недоступный файл не должен ломать запрос.
+        logger.exception('Не удалось удалить картинку %s', image_name)
+        return False
+    return True
+
+
+def orphans(queryset, grace=None):
+    """
+    Имена файлов в каталоге картинок, на которые не ссылается ни одна
+    строка queryset и которые не использовались последние grace секунд.
+    """
+    if grace is None:
+        grace = settings.POST_IMAGE_RELEASE_GRACE
+    field = queryset.model._meta.get_field('image')
+    storage = field.storage
+    directories = [field.upload_to.rstrip('/')]
+    while directories:
+        directory = directories.pop()
+        if not storage.exists(directory):
+            continue
+        subdirectories, files = storage.listdir(directory)
+        directories.extend(os.path.join(directory, name)
+                           for name in subdirectories)
+        names = [os.path.join(directory, filename) for filename in files
+                 if filename != LOCK_NAME]
+        used = set(queryset.filter(image__in=names)
+                   .values_list('image', flat=True))
+        yield from (name for name in names if name not in used
+                    and _idle_seconds(storage, name) >= grace)
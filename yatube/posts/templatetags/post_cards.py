@@ -0,0 +1,68 @@
+"""
+Кеширование отрисованных карточек постов.
+
+Карточка без персональной части (ссылки «Редактировать») одинакова для
+всех пользователей и меняется только при изменении поста, поэтому она
+кешируется по ключу из id поста, отметки Post.updated и счётчика
+комментариев. Фрагменты всей страницы ленты достаются из кеша одним
+get_many.
+"""
+
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import caching, profiling, thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card_body.html'
+CARD_CACHE_TIME = 60 * 60 * 24
+
+
+def card_key(post, prefix) -> str:
+    # Счётчик комментариев меняется без изменения Post.updated.
+    return (f'post_card:{prefix}:{post.pk}:{post.updated.timestamp()}:'
+            f'{post.comments_count}')
+
+
+def render_cards(posts) -> dict:
+    """Возвращает словарь {id поста: html карточки} для списка постов."""
+    # Название группы выводится в карточке, поэтому переименование
+    # любой группы сбрасывает все карточки.
+    prefix = caching.get_generations(caching.GROUPS)[0]
+    keys = {card_key(post, prefix): post for post in posts}
+    cards = cache.get_many(keys)
+    thumbnails.prefetch(
+        [post for key, post in keys.items() if key not in cards], 'card')
+    missing = {
+        key: render_to_string(CARD_TEMPLATE, {'post': post})
+        for key, post in keys.items() if key not in cards
+    }
+    profiling.count('card_hits', len(cards))
+    profiling.count('card_misses', len(missing))
+    if missing:
+        # Карточки с оригиналом вместо ещё не готовой миниатюры
+        # не кешируются.
+        cache.set_many({
+            key: card for key, card in missing.items()
+            if not getattr(keys[key], 'thumbnail_pending', False)
+        }, CARD_CACHE_TIME)
+        cards.update(missing)
+    return {post.pk: mark_safe(cards[key]) for key, post in keys.items()}
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_post_cards(context, posts):
+    """Загружает карточки всей страницы одним обращением к кешу."""
+    context['post_cards'] = render_cards(posts)
+    return ''
+
+
+@register.simple_tag(takes_context=True)
+def post_card_body(context, post):
+    cards = context.get('post_cards') or {}
+    if post.pk in cards:
+        return cards[post.pk]
+    return render_cards([post])[post.pk]
@@ -0,0 +1,21 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(image, name):
+    """
+    Готовые варианты картинки поста (размер name из POST_THUMBNAILS)
+    или None — тогда шаблон показывает оригинал, а пост помечается,
+    чтобы его карточку с оригиналом не кешировать. Миниатюры создаются
+    при сохранении поста или командой warm_thumbnails, а не при показе.
+    """
+    if not image:
+        return None
+    picture = thumbnails.cached_picture(image, name)
+    if picture is None:
+        image.instance.thumbnail_pending = True
+    return picture
@@ -0,0 +1,11 @@
+from django import template
+
+from posts.paginator import page_window
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_links(page_obj):
+    """Номера страниц для ссылок паджинатора (см. page_window)."""
+    return page_window(page_obj)
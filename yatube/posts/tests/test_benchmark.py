@@ -0,0 +1,47 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from .. import benchmark
+from ..models import Post
+
+User = get_user_model()
+
+
+class BenchmarkTests(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+    def test_benchmark_command(self):
+        """Замер пишет перцентили всех страниц и откатывает данные."""
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'benchmark', users=20, posts=100, comments=50, follows=3,
+                images=1, iterations=3, output=output.name,
+                stdout=StringIO())
+            result = json.load(output)
+        self.assertEqual(set(result['scenarios']), set(benchmark.SCENARIOS))
+        for stats in result['scenarios'].values():
+            self.assertEqual(stats['requests'], 3)
+            self.assertLessEqual(stats['p50'], stats['p99'])
+        self.assertEqual(result['dataset']['posts'], 100)
+        # Даты постов разнесены по days (365) дням, а не совпадают.
+        self.assertGreater(result['dataset']['pub_date_days'], 100)
+        self.assertFalse(User.objects.filter(
+            username__startswith=benchmark.USERNAME_PREFIX).exists())
+        self.assertFalse(Post.objects.exists())
+
+    def test_sqlite_concurrency(self):
+        results = benchmark.sqlite_concurrency(
+            readers=1, writers=1, seconds=0.2, rows=100)
+        self.assertEqual(set(results), set(benchmark.SQLITE_PROFILES))
+        for roles in results.values():
+            self.assertGreater(roles['reader']['ops_per_second'], 0)
+            self.assertGreater(roles['writer']['ops_per_second'], 0)
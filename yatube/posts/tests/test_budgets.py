@@ -0,0 +1,172 @@
+"""
+Бюджеты страниц: число SQL-запросов и время ответа для каждого URL
+приложений posts, users и about на засеянных данных.
+
+Каждое имя URL обязано иметь бюджет в BUDGETS. При превышении тест
+выводит все запросы страницы, а повторяющиеся (признак N+1) — сводкой
+с числом повторов.
+"""
+
+import time
+from collections import Counter
+from typing import Callable, NamedTuple
+
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import constants as const
+from ..models import Comment, Follow
+from ..slow_queries import fingerprint
+from ..views import POSTS_PER_PAGE
+
+# Сколько раз запрашивать страницу: время берётся лучшее, а число
+# запросов — наибольшее из всех попыток.
+RUNS = 3
+# Время с запасом на медленные машины: бюджет ловит порядки, а не
+# проценты (проценты сравнивает команда benchmark).
+DEFAULT_MS = 300
+APPS = ('posts', 'users', 'about')
+
+
+def no_args(test):
+    return []
+
+
+class Budget(NamedTuple):
+    queries: int
+    ms: float = DEFAULT_MS
+    args: Callable = no_args
+    login: bool = False
+
+
+# Авторизованному клиенту сессия и пользователь стоят двух запросов,
+# подписка и отписка — ещё и точек сохранения транзакции.
+BUDGETS = {
+    'posts:home': Budget(3),
+    'posts:group_list': Budget(2, args=lambda test: [test.group.slug]),
+    'posts:profile': Budget(3, args=lambda test: [test.author.username]),
+    'posts:post_detail': Budget(2, args=lambda test: [test.post.pk]),
+    'posts:post_create': Budget(4, login=True),
+    'posts:post_edit': Budget(
+        5, args=lambda test: [test.post.pk], login=True),
+    'posts:search_results': Budget(2),
+    'posts:post_comments': Budget(2, args=lambda test: [test.post.pk]),
+    'posts:add_comment': Budget(
+        3, args=lambda test: [test.post.pk], login=True),
+    'posts:follow_index': Budget(3, login=True),
+    'posts:profile_follow': Budget(
+        9, args=lambda test: [test.another_author.username], login=True),
+    'posts:profile_unfollow': Budget(
+        8, args=lambda test: [test.author.username], login=True),
+    'posts:metrics': Budget(0),
+    'users:logout': Budget(4, login=True),
+    'users:signup': Budget(0),
+    'users:login': Budget(0),
+    'users:password_change_form': Budget(2, login=True),
+    'users:password_change_done': Budget(2, login=True),
+    'users:password_reset_form': Budget(0),
+    'users:password_reset_done': Budget(0),
+    'users:password_reset_confirm': Budget(5, args=lambda test: [
+        urlsafe_base64_encode(force_bytes(test.user.pk)),
+        default_token_generator.make_token(test.user)]),
+    'users:password_reset_complete': Budget(0),
+    'about:author': Budget(0),
+    'about:tech': Budget(0),
+}
+
+
+def sql_report(queries):
+    """Текст со всеми запросами и сводкой повторяющихся."""
+    lines = [f'{i:>3}. [{query["time"]} с] {query["sql"]}'
+             for i, query in enumerate(queries, 1)]
+    repeated = Counter(fingerprint(query['sql']) for query in queries)
+    repeated = [(sql, count) for sql, count in repeated.most_common()
+                if count > 1]
+    if repeated:
+        lines.append('Повторяющиеся запросы:')
+        lines.extend(f'  ×{count} {sql}' for sql, count in repeated)
+    return '\n'.join(lines)
+
+
+def url_names():
+    """Имена всех URL приложений APPS вида 'posts:home'."""
+    names = set()
+    for pattern in get_resolver().url_patterns:
+        if isinstance(pattern, URLResolver) and pattern.namespace in APPS:
+            names.update(f'{pattern.namespace}:{url.name}'
+                         for url in pattern.url_patterns if url.name)
+    return names
+
+
+# Страница метрик измеряется для сборщика с разрешённого адреса.
+@override_settings(METRICS_ALLOWED_IPS=('127.0.0.1',))
+class BudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.user.set_password('password')
+        cls.user.save()
+        cls.author = const.create_test_user(username='author')
+        cls.another_author = const.create_test_user(username='another')
+        cls.group = const.create_test_group()
+        cls.another_group = const.create_test_group('Другая группа',
+                                                    'another-slug')
+        for i in range(POSTS_PER_PAGE + 5):
+            post = const.create_test_post(
+                cls.author if i % 2 else cls.another_author,
+                cls.group if i % 3 else cls.another_group,
+            )
+        cls.post = post
+        for author in (cls.user, cls.author, cls.another_author):
+            Comment.objects.create(post=post, author=author, text='Ок')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def measure(self, url, login):
+        timings, counts = [], []
+        for _ in range(RUNS):
+            client = Client()
+            if login:
+                client.force_login(self.user)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.assertLess(response.status_code, 400, url)
+            counts.append(len(queries))
+            if len(queries) == max(counts):
+                worst = queries.captured_queries
+        return min(timings), worst
+
+    def test_every_url_has_budget(self):
+        self.assertEqual(url_names() - set(BUDGETS), set())
+
+    def test_budgets(self):
+        for name, budget in BUDGETS.items():
+            url = reverse(name, args=budget.args(self))
+            with self.subTest(url=url):
+                elapsed, queries = self.measure(url, budget.login)
+                self.assertLessEqual(
+                    len(queries), budget.queries,
+                    f'{url}: {len(queries)} запросов при бюджете '
+                    f'{budget.queries}\n{sql_report(queries)}')
+                self.assertLessEqual(
+                    elapsed, budget.ms,
+                    f'{url}: {elapsed:.1f} мс при бюджете {budget.ms} мс\n'
+                    f'{sql_report(queries)}')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_group(cls.group)
+        const.delete_test_group(cls.another_group)
+        const.delete_test_user(cls.user)
+        const.delete_test_user(cls.author)
+        const.delete_test_user(cls.another_author)
@@ -1,10 +1,14 @@
-from django.core.cache import cache
-from django.test import TestCase, Client
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
-from time import sleep
 
 from . import constants as const
-from .. views import CACH_TIME
+from .. import caching
+from ..models import Comment, Group, Post
+from ..views import CACH_TIME
 
 
 class IndexViewTestCase(TestCase):
@@ -12,7 +16,10 @@ class IndexViewTestCase(TestCase):
     def setUpClass(cls):
         super().setUpClass()
         cls.user = const.create_test_user()
-        cls.post = const.create_test_post(cls.user)
+        cls.group = const.create_test_group()
+        cls.another_group = const.create_test_group('Другая группа',
+                                                    'another-slug')
+        cls.post = const.create_test_post(cls.user, cls.group)
 
     def setUp(self):
         self.authorized_client = Client()
@@ -20,18 +27,169 @@ class IndexViewTestCase(TestCase):
         cache.clear()
 
     def test_cache(self):
+        """Страница берётся из кеша, пока данные не менялись."""
+        urls = (
+            reverse('posts:home'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.user.username]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, self.post.text)
+
+                # update() не посылает сигналов, поэтому кеш не сбросится.
+                Post.objects.filter(pk=self.post.pk).update(text='Изменён')
+                response = self.authorized_client.get(url)
+                self.assertContains(response, self.post.text)
+                Post.objects.filter(pk=self.post.pk).update(
+                    text=self.post.text)
+
+    def test_cache_invalidated_on_delete(self):
         response = self.authorized_client.get(reverse('posts:home'))
         self.assertContains(response, self.post.text)
 
-        self.post.delete()
+        Post.objects.get(pk=self.post.pk).delete()
         response = self.authorized_client.get(reverse('posts:home'))
+        self.assertNotContains(response, self.post.text)
+
+    def test_cache_invalidated_per_group(self):
+        """Пост в одной группе не сбрасывает кеш страниц другой группы."""
+        group_url = reverse('posts:group_list', args=[self.group.slug])
+        another_url = reverse('posts:group_list',
+                              args=[self.another_group.slug])
+        self.authorized_client.get(group_url)
+        self.authorized_client.get(another_url)
+
+        Post.objects.filter(pk=self.post.pk).update(text='Изменён')
+        new_post = Post.objects.create(author=self.user, text='Новый пост',
+                                       group=self.another_group)
+        response = self.authorized_client.get(another_url)
+        self.assertContains(response, new_post.text)
+        response = self.authorized_client.get(group_url)
         self.assertContains(response, self.post.text)
 
-        sleep(CACH_TIME)
-        response = self.authorized_client.get(reverse('posts:home'))
+    def test_cache_invalidated_on_edit_group_change(self):
+        """При переносе поста обновляются страницы обеих групп."""
+        group_url = reverse('posts:group_list', args=[self.group.slug])
+        self.authorized_client.get(group_url)
+        post = Post.objects.get(pk=self.post.pk)
+        post.group = self.another_group
+        post.save()
+        response = self.authorized_client.get(group_url)
         self.assertNotContains(response, self.post.text)
 
+    def test_cache_invalidated_by_group_and_comment(self):
+        url = reverse('posts:home')
+        self.authorized_client.get(url)
+        Group.objects.filter(pk=self.group.pk).update(title='Новое имя')
+        Group.objects.get(pk=self.group.pk).save()
+        self.assertContains(self.authorized_client.get(url), 'Новое имя')
+
+        # Комментарий сбрасывает страницу: она отрисовывается заново.
+        self.assertIsNone(self.authorized_client.get(url).context)
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        self.assertIsNotNone(self.authorized_client.get(url).context)
+
+    def test_post_card_fragment_cache(self):
+        """Карточка общая для всех, ссылка «Редактировать» — только автору."""
+        url = reverse('posts:group_list', args=[self.group.slug])
+        edit_url = reverse('posts:post_edit', args=[self.post.pk])
+        self.assertContains(self.authorized_client.get(url), edit_url)
+
+        # Гость получает свою копию страницы, но карточку из общего кеша:
+        # изменение без сигналов и без смены Post.updated не видно.
+        Post.objects.filter(pk=self.post.pk).update(text='Без отметки')
+        response = self.client.get(url)
+        self.assertContains(response, self.post.text)
+        self.assertNotContains(response, edit_url)
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Отредактированный пост'
+        post.save()
+        self.assertContains(self.client.get(url), post.text)
+
+    def test_cache_varies_on_cookie(self):
+        """Гость не получает закешированную страницу другого пользователя."""
+        url = reverse('posts:profile', args=[self.user.username])
+        self.assertContains(self.authorized_client.get(url), 'Выйти')
+        self.assertNotContains(self.client.get(url), 'Выйти')
+
+    def test_anonymous_pages_are_shared(self):
+        """Гостевые страницы не зависят от cookie и доступны прокси."""
+        urls = (
+            reverse('posts:home'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.user.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('about:author'),
+            reverse('about:tech'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIsNotNone(response.context)
+                self.assertNotIn('Cookie', response.get('Vary', ''))
+                self.assertIn('public', response['Cache-Control'])
+                self.assertFalse(response.cookies)
+
+                other_guest = Client()
+                other_guest.cookies['csrftoken'] = 'other'
+                response = other_guest.get(url)
+                self.assertIsNone(response.context)
+
+                for _ in range(2):
+                    response = self.authorized_client.get(url)
+                    cache_control = response['Cache-Control']
+                    self.assertIn('private', cache_control)
+                    self.assertIn('no-cache', cache_control)
+                    self.assertIn('max-age=0', cache_control)
+                    self.assertContains(response, 'Выйти')
+
+    def stored_timeouts(self, client):
+        backend = caches['default']
+        with mock.patch.object(backend, 'set', wraps=backend.set) as set_:
+            response = client.get(reverse('posts:home'))
+        return response, {call[0][2] for call in set_.call_args_list
+                          if '.cache_page.' in call[0][0]}
+
+    def test_anonymous_page_stored_for_full_timeout(self):
+        """Срок для прокси не укорачивает запись в кеше сервера."""
+        # Кеш считается общим для воркеров.
+        with mock.patch.object(caching, 'LOCAL_CACHE_BACKENDS', ()):
+            response, timeouts = self.stored_timeouts(self.client)
+        self.assertEqual(timeouts, {CACH_TIME})
+        self.assertIn(f'max-age={settings.ANONYMOUS_CACHE_TIME}',
+                      response['Cache-Control'])
+
+        response = Client().get(reverse('posts:home'))
+        self.assertIsNone(response.context)
+        self.assertIn(f'max-age={settings.ANONYMOUS_CACHE_TIME}',
+                      response['Cache-Control'])
+
+    @override_settings(LOCAL_PAGE_CACHE_TIME=15)
+    def test_process_cache_keeps_pages_briefly(self):
+        """В кеше процесса чужие воркеры не видят смены поколений."""
+        _, timeouts = self.stored_timeouts(self.authorized_client)
+        self.assertEqual(timeouts, {15})
+
+    def test_bump_repeated_after_commit(self):
+        """Страница, закешированная до коммита, сбрасывается после него."""
+        callbacks = []
+        with mock.patch('django.db.transaction.on_commit',
+                        side_effect=callbacks.append):
+            [before] = caching.get_generations(caching.FEED)
+            caching.bump(caching.FEED)
+        [bumped] = caching.get_generations(caching.FEED)
+        self.assertNotEqual(bumped, before)
+        for callback in callbacks:
+            callback()
+        [committed] = caching.get_generations(caching.FEED)
+        self.assertNotEqual(committed, bumped)
+
     @classmethod
     def tearDownClass(cls):
         super().tearDownClass()
         const.delete_test_user(cls.user)
+        const.delete_test_group(cls.group)
+        const.delete_test_group(cls.another_group)
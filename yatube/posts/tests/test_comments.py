@@ -0,0 +1,66 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from . import constants as const
+from ..models import Comment
+from ..views import COMMENTS_PER_PAGE
+
+
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.post = const.create_test_post(cls.user)
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(COMMENTS_PER_PAGE + 5))
+        cls.newest = Comment.objects.order_by('-created', '-id')
+        cls.detail_url = reverse('posts:post_detail', args=[cls.post.pk])
+        cls.comments_url = reverse('posts:post_comments',
+                                   args=[cls.post.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detail_renders_first_page(self):
+        response = self.client.get(self.detail_url)
+        page = response.context['comments_page']
+        self.assertEqual(list(page), list(self.newest[:COMMENTS_PER_PAGE]))
+        self.assertTrue(page.has_next())
+        self.assertContains(response, 'js-more-comments')
+
+    def test_next_pages_by_cursor(self):
+        cursor = self.client.get(
+            self.detail_url).context['comments_page'].paginator.next_cursor
+        response = self.client.get(self.comments_url, {'cursor': cursor})
+        rest = list(self.newest[COMMENTS_PER_PAGE:])
+        self.assertEqual(list(response.context['comments_page']), rest)
+        self.assertNotContains(response, '<html')
+        self.assertNotContains(response, 'js-more-comments')
+
+        detail = self.client.get(self.detail_url, {'cursor': cursor})
+        self.assertEqual(list(detail.context['comments_page']), rest)
+        self.assertContains(detail, 'К новым комментариям')
+
+    def test_json(self):
+        data = self.client.get(self.comments_url, {'format': 'json'}).json()
+        self.assertEqual(len(data['comments']), COMMENTS_PER_PAGE)
+        self.assertEqual(data['comments'][0]['text'], self.newest[0].text)
+        self.assertEqual(data['comments'][0]['author'], self.user.username)
+        data = self.client.get(data['next']).json()
+        self.assertEqual([comment['id'] for comment in data['comments']],
+                         [comment.id for comment
+                          in self.newest[COMMENTS_PER_PAGE:]])
+        self.assertIsNone(data['next'])
+
+    def test_missing_post(self):
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
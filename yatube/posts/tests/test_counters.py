@@ -0,0 +1,110 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import constants as const
+from ..models import AuthorStats, Comment, Group, Post
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.author = const.create_test_user('Author')
+        cls.group = const.create_test_group()
+        cls.another_group = const.create_test_group('Другая группа',
+                                                    'another-slug')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+        self.follower_client = Client()
+        self.follower_client.force_login(self.user)
+        cache.clear()
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_counters_follow_views(self):
+        self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост для счётчиков', 'group': self.group.pk})
+        post = Post.objects.get(text='Пост для счётчиков')
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 1)
+
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            {'text': post.text, 'group': self.another_group.pk})
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 0)
+        self.assertEqual(
+            Group.objects.get(pk=self.another_group.pk).posts_count, 1)
+
+        self.follower_client.post(reverse('posts:add_comment',
+                                          args=[post.pk]), {'text': 'Ок'})
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+
+        self.follower_client.get(reverse('posts:profile_follow',
+                                         args=[self.author.username]))
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.user).following_count, 1)
+        response = self.follower_client.get(
+            reverse('posts:profile', args=[self.author.username]))
+        self.assertContains(response, 'Подписчиков: 1')
+
+        self.follower_client.get(reverse('posts:profile_unfollow',
+                                         args=[self.author.username]))
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.user).following_count, 0)
+
+        Post.objects.get(pk=post.pk).delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+        self.assertEqual(
+            Group.objects.get(pk=self.another_group.pk).posts_count, 0)
+
+    def test_post_delete_skips_comment_signals(self):
+        """Число запросов при удалении поста не растёт с комментариями."""
+        queries = []
+        for comments in (1, 20):
+            post = const.create_test_post(self.author, self.group)
+            Comment.objects.bulk_create(
+                Comment(post=post, author=self.user, text='Ок')
+                for _ in range(comments))
+            post = Post.objects.get(pk=post.pk)
+            with CaptureQueriesContext(connection) as captured:
+                post.delete()
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+        post = const.create_test_post(self.author, self.group)
+        comment = Comment.objects.create(post=post, author=self.user,
+                                         text='Ок')
+        comment.delete()
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 0)
+
+    def test_reconcile_counters_command(self):
+        post = const.create_test_post(self.author, self.group)
+        Post.objects.filter(pk=post.pk).update(comments_count=7)
+        Group.objects.update(posts_count=5)
+        AuthorStats.objects.all().delete()
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 0)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 1)
+        self.assertEqual(
+            Group.objects.get(pk=self.another_group.pk).posts_count, 0)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_group(cls.group)
+        const.delete_test_group(cls.another_group)
+        const.delete_test_user(cls.user)
+        const.delete_test_user(cls.author)
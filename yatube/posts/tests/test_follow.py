@@ -1,11 +1,14 @@
+from io import StringIO
+
 from django.test import TestCase
 from django.urls import reverse
 from django.core.cache import cache
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.cache import cache
+from django.core.management import call_command
 
-from ..models import Follow, Post
+from ..models import Follow, Post, TimelineEntry
 from . import constants as const
 
 
@@ -54,3 +57,61 @@ class FollowTests(TestCase):
         response = self.not_follow_client.get(
             reverse('posts:follow_index'))
         self.assertNotContains(response, another_post.text)
+
+    def test_follow_updates_follower_profile(self):
+        url = reverse('posts:profile', args=[self.user.username])
+        response = self.client.get(url)
+        self.assertEqual(
+            response.context['author_stats'].following_count, 0)
+
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', args=[self.another_user.username]))
+        response = self.client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertEqual(
+            response.context['author_stats'].following_count, 1)
+
+
+@override_settings(FOLLOW_TIMELINE=True)
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.author = const.create_test_user('Author')
+        cls.post = const.create_test_post(cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def follow_page_posts(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_timeline_follow_post_unfollow(self):
+        """Лента наполняется при подписке и публикации, чистится отпиской."""
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', args=[self.author.username]))
+        self.assertEqual(self.follow_page_posts(), [self.post])
+
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertEqual(self.follow_page_posts(), [new_post, self.post])
+
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', args=[self.author.username]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user))
+        self.assertEqual(self.follow_page_posts(), [])
+
+    def test_rebuild_timelines_command(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(self.follow_page_posts(), [self.post])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
+        const.delete_test_user(cls.author)
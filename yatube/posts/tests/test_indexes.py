@@ -0,0 +1,72 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import constants as const
+from .. import timeline
+from ..models import Comment, Follow
+
+POSTS_TABLES = ('posts_post', 'posts_comment', 'posts_follow',
+                'posts_timelineentry')
+
+
+class QueryPlanTests(TestCase):
+    """Запросы лент используют индексы, а не полный скан и сортировку."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.author = const.create_test_user(username='author')
+        cls.group = const.create_test_group()
+        for _ in range(3):
+            cls.post = const.create_test_post(cls.author, cls.group)
+        Comment.objects.create(post=cls.post, author=cls.user, text='Тест')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_uses_indexes(self, url, allow_temp_sort=False):
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(url)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(
+                    table in sql for table in POSTS_TABLES):
+                continue
+            with self.subTest(url=url, sql=sql):
+                for step in self.explain(sql):
+                    if step.startswith('SCAN'):
+                        self.assertIn('USING', step)
+                    if not allow_temp_sort:
+                        self.assertNotIn('TEMP B-TREE', step)
+
+    def test_views_use_indexes(self):
+        urls = (
+            reverse('posts:home'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.id]),
+        )
+        for url in urls:
+            self.assert_uses_indexes(url)
+        # Лента подписок сливает посты нескольких авторов, поэтому
+        # без материализованной ленты сортировка во временном B-дереве
+        # для неё неизбежна.
+        self.assert_uses_indexes(reverse('posts:follow_index'),
+                                 allow_temp_sort=True)
+
+    @override_settings(FOLLOW_TIMELINE=True)
+    def test_timeline_uses_index(self):
+        timeline.rebuild()
+        self.assert_uses_indexes(reverse('posts:follow_index'))
@@ -0,0 +1,98 @@
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import constants as const
+from .. import metrics
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.post = const.create_test_post(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_request_metrics(self):
+        self.client.get(reverse('posts:home'))
+        self.client.get(reverse('posts:home'))
+        response = self.client.get(reverse('posts:metrics'),
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram',
+                      text)
+        self.assertRegex(text, r'yatube_requests_total\{method="GET",'
+                               r'status="200",view="posts:home"\} \d+')
+        self.assertRegex(text, r'yatube_request_duration_seconds_bucket\{'
+                               r'view="posts:home",le="\+Inf"\} \d+')
+        self.assertRegex(text, r'yatube_request_queries_count\{'
+                               r'view="posts:home"\} \d+')
+        self.assertRegex(text, r'yatube_cache_lookups_total\{cache="page",'
+                               r'result="hit",view="posts:home"\} [1-9]')
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.001, 0.3, 100):
+            metrics.THUMBNAIL_DURATION.observe(value, test='buckets')
+        text = metrics.render()
+        for le, expected in (('0.005', 1), ('0.25', 1), ('0.5', 2),
+                             ('5', 2), ('+Inf', 3)):
+            self.assertIn(f'yatube_thumbnail_duration_seconds_bucket'
+                          f'{{test="buckets",le="{le}"}} {expected}', text)
+        self.assertIn('yatube_thumbnail_duration_seconds_count'
+                      '{test="buckets"} 3', text)
+
+    def test_shared_database_sums_processes(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DB=os.path.join(directory, 'm.db')):
+            # Два «воркера» по очереди сбрасывают свои приросты в файл.
+            metrics.UPLOADS.inc(2, result='shared')
+            metrics.flush()
+            metrics.UPLOADS.inc(3, result='shared')
+            text = metrics.render()
+        self.assertIn('yatube_uploads_total{result="shared"} 5', text)
+
+    def test_failed_flush_keeps_values(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DB=directory):
+            metrics.UPLOADS.inc(4, result='unflushed')
+            with self.assertLogs('posts.metrics', 'ERROR'):
+                metrics.flush()
+        with override_settings(METRICS_DB=None):
+            text = metrics.render()
+        self.assertIn('yatube_uploads_total{result="unflushed"} 4', text)
+
+    def test_hidden_from_strangers(self):
+        url = reverse('posts:metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        url = reverse('posts:metrics')
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_ALLOWED_IPS=('10.0.0.5',))
+    def test_allowed_ips(self):
+        url = reverse('posts:metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(url, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
@@ -1,9 +1,19 @@
+import base64
+import json
 from math import ceil
-from django.test import TestCase, Client
+from unittest import mock
+
+from django.core.paginator import Paginator
+from django.test import SimpleTestCase, TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from . import constants as const
+from .. import counters
+from ..models import Follow, Post
+from ..paginator import page_window
 from ..views import POSTS_PER_PAGE
 
 add_post_count = ceil(POSTS_PER_PAGE / 2)
@@ -54,8 +64,153 @@ class PaginatorViewsTest(TestCase):
                 real_count = len(response.context['page_obj'])
                 self.assertEqual(real_count, expected_count)
 
+    def test_keyset_pagination_cursor(self):
+        """Переход по курсору вперёд и назад без COUNT и OFFSET."""
+        url = reverse('posts:home')
+        with CaptureQueriesContext(connection) as queries:
+            first_page = self.client.get(url).context['page_obj']
+        self.assertFalse(any('COUNT(' in query['sql'].upper()
+                             for query in queries.captured_queries))
+        self.assertEqual(len(first_page), POSTS_PER_PAGE)
+        self.assertTrue(first_page.has_next())
+
+        next_cursor = first_page.paginator.next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            second_page = self.client.get(
+                url, {'cursor': next_cursor}).context['page_obj']
+        self.assertFalse(any('OFFSET' in query['sql'].upper()
+                             for query in queries.captured_queries))
+        self.assertEqual(second_page.number, 2)
+        self.assertEqual(len(second_page), add_post_count)
+        self.assertFalse(second_page.has_next())
+        self.assertFalse(set(first_page) & set(second_page))
+
+        previous_cursor = second_page.paginator.previous_cursor
+        back_page = self.client.get(
+            url, {'cursor': previous_cursor}).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+        self.assertFalse(back_page.has_previous())
+
+    def test_keyset_pagination_invalid_cursor(self):
+        """Битый курсор приводит к первой странице."""
+        values = [self.post0.pub_date.isoformat(), str(self.post0.pk)]
+        cursors = [
+            'not-a-cursor',
+            [2, True, [None, None]],
+            [2, True, values[:1]],
+            [2, True, values + values[:1]],
+            [2, True, {'pub_date': values[0]}],
+        ]
+        for cursor in cursors:
+            if not isinstance(cursor, str):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps(cursor).encode()).decode()
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('posts:home'),
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['page_obj'].number, 1)
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_page_links(self):
+        """Паджинатор по номерам показывает ссылки из окна страниц."""
+        response = self.client.get(reverse('posts:home'), {'page': 2})
+        self.assertContains(response, '?page=1"')
+        self.assertContains(response, '<span class="page-link">2</span>',
+                            html=True)
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_pages_without_count(self):
+        """Размеры лент берутся из счётчиков, без COUNT по постам."""
+        reader = const.create_test_user('reader')
+        Follow.objects.create(user=reader, author=self.user)
+        client = Client()
+        client.force_login(reader)
+        pages = {
+            reverse('posts:home'): 2,
+            reverse('posts:group_list', args=[self.group.slug]): 2,
+            reverse('posts:profile', args=[self.user.username]): 2,
+            reverse('posts:follow_index'): 2,
+        }
+        counters.feed_total()
+        for url, num_pages in pages.items():
+            with self.subTest(url=url), \
+                    CaptureQueriesContext(connection) as queries:
+                page_obj = client.get(url, {'page': 2}).context['page_obj']
+                self.assertEqual(page_obj.paginator.num_pages, num_pages)
+                self.assertEqual(len(page_obj), add_post_count)
+                self.assertFalse(any(
+                    'COUNT(' in query['sql'].upper()
+                    and 'posts_post' in query['sql']
+                    for query in queries.captured_queries))
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_follow_total_counts_new_posts(self):
+        """Новый пост автора из подписок не прячет последнюю страницу."""
+        reader = const.create_test_user('reader')
+        Follow.objects.create(user=reader, author=self.user)
+        client = Client()
+        client.force_login(reader)
+        url = reverse('posts:follow_index')
+        counters.follow_total(reader)
+        # TestCase не выполняет колбэки on_commit, поэтому сразу.
+        with mock.patch('django.db.transaction.on_commit',
+                        side_effect=lambda func: func()):
+            for _ in range(POSTS_PER_PAGE - add_post_count + 1):
+                Post.objects.create(author=self.user, text='Новый пост')
+        page_obj = client.get(url, {'page': 3}).context['page_obj']
+        self.assertEqual(page_obj.paginator.num_pages, 3)
+        self.assertEqual(len(page_obj), 1)
+
+    @override_settings(POSTS_PAGINATION='pages', FEED_COUNT_EXACT_LIMIT=0)
+    def test_estimated_feed_total(self):
+        """Завышенная оценка исправляется на странице за концом ленты."""
+        posts_count = POSTS_PER_PAGE + add_post_count
+        counters.set_feed_total(posts_count * 10)
+        page_obj = self.client.get(
+            reverse('posts:home'), {'page': 5}).context['page_obj']
+        self.assertEqual(page_obj.number, 2)
+        self.assertEqual(len(page_obj), add_post_count)
+        self.assertEqual(counters.feed_total(), posts_count)
+
+    @override_settings(POSTS_PAGINATION='pages')
+    def test_underestimated_feed_total(self):
+        """Заниженный total из кеша другого воркера не прячет старые посты."""
+        posts_count = POSTS_PER_PAGE + add_post_count
+        for total, number in ((POSTS_PER_PAGE, 1), (POSTS_PER_PAGE + 1, 2),
+                              (POSTS_PER_PAGE, 2)):
+            with self.subTest(total=total, number=number):
+                cache.clear()
+                counters.set_feed_total(total)
+                page_obj = self.client.get(
+                    reverse('posts:home'),
+                    {'page': number}).context['page_obj']
+                self.assertEqual(page_obj.number, number)
+                self.assertEqual(page_obj.paginator.num_pages, 2)
+                rest = posts_count - POSTS_PER_PAGE * (number - 1)
+                self.assertEqual(len(page_obj), min(POSTS_PER_PAGE, rest))
+                self.assertEqual(counters.feed_total(), posts_count)
+
     @classmethod
     def tearDownClass(cls):
         super().tearDownClass()
         const.delete_test_user(cls.user)
         const.delete_test_group(cls.group)
+
+
+class PageWindowTest(SimpleTestCase):
+    def window(self, number, count):
+        return page_window(Paginator(range(count), 1).page(number))
+
+    def test_page_window(self):
+        self.assertEqual(self.window(1, 1), [1])
+        self.assertEqual(self.window(1, 4), [1, 2, 3, 4])
+        self.assertEqual(self.window(1, 100), [1, 2, 3, None, 100])
+        self.assertEqual(self.window(50, 100),
+                         [1, None, 48, 49, 50, 51, 52, None, 100])
+        self.assertEqual(self.window(100, 100), [1, None, 98, 99, 100])
+        # Одна пропущенная страница показывается вместо многоточия.
+        self.assertEqual(self.window(4, 7), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_window_size_is_bounded(self):
+        self.assertLessEqual(len(self.window(5000, 100000)), 9)
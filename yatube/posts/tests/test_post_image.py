@@ -1,9 +1,24 @@
-from django.test import TestCase, Client
+import os
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.db.models.fields.files import ImageFieldFile
 from django.core.cache import cache
+from PIL import Image
 
 from . import constants as const
+from .. import thumbnails
+from ..models import Post
+from ..storage import release
 
 
 class TaskViewTests(TestCase):
@@ -78,3 +93,175 @@ class TaskViewTests(TestCase):
         const.delete_test_user(cls.author)
         const.delete_test_group(cls.group)
         cache.clear()
+
+
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = const.create_test_user()
+        content = BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(content, 'PNG')
+        cls.post = const.create_test_post(
+            cls.author, image=SimpleUploadedFile('red.png', content.getvalue(),
+                                                 content_type='image/png'))
+
+    def setUp(self):
+        cache.clear()
+        thumbnails.clear_lookups()
+
+    def test_thumbnail_generated_off_request(self):
+        """Страница не создаёт миниатюру и не ставит её в очередь."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            response = self.client.get(url)
+        schedule.assert_not_called()
+        self.assertContains(response, self.post.image.url)
+
+        variants = sum(len(thumbnails.variants(name))
+                       for name in settings.POST_THUMBNAILS)
+        self.assertEqual(thumbnails.generate(self.post.image.name), variants)
+        cache.clear()
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            response = self.client.get(url)
+        schedule.assert_not_called()
+        picture = thumbnails.cached_picture(self.post.image, 'detail')
+        self.assertContains(response, f'src="{picture.src}"')
+        self.assertContains(response, f'srcset="{picture.srcset}"')
+        self.assertNotContains(response, self.post.image.url)
+
+    @override_settings(POST_IMAGE_FORMATS={'WEBP': 75, 'JPEG': 85})
+    def test_picture_variants(self):
+        """Варианты создаются по каждой ширине, формат — если поддержан."""
+        widths = settings.POST_THUMBNAILS['card']['widths']
+        with mock.patch.object(thumbnails.Image, 'SAVE', {'JPEG': None}):
+            self.assertEqual(
+                [(variant.format, variant.width)
+                 for variant in thumbnails.variants('card')],
+                [('JPEG', width) for width in widths])
+        with mock.patch.object(thumbnails, 'image_formats',
+                               return_value=['JPEG']):
+            thumbnails.generate(self.post.image.name)
+            picture = thumbnails.cached_picture(self.post.image, 'card')
+        self.assertEqual(picture.sources, [])
+        self.assertEqual(picture.srcset.count('.jpg '), len(widths))
+        self.assertEqual(picture.width, max(widths))
+
+        with mock.patch.object(thumbnails.Image, 'SAVE',
+                               {'JPEG': None, 'WEBP': None}):
+            self.assertEqual(
+                [variant.format for variant in thumbnails.variants('card')],
+                ['WEBP'] * len(widths) + ['JPEG'] * len(widths))
+
+    def test_thumbnail_lookups_are_batched(self):
+        """Миниатюры страницы ищутся одним get_many, затем в памяти."""
+        thumbnails.generate(self.post.image.name)
+        images = [Post.objects.get(pk=self.post.pk).image for _ in range(3)]
+        with self.assertNumQueries(0), \
+                mock.patch('os.stat', side_effect=AssertionError):
+            found = thumbnails.resolve(images, 'card')
+            self.assertEqual(
+                [picture.srcset
+                 for picture in thumbnails.resolve(images, 'card')],
+                [picture.srcset for picture in found])
+        variants = len(thumbnails.variants('card'))
+        stats = thumbnails.lookup_stats()
+        self.assertEqual(stats['cache_hits'], variants)
+        self.assertEqual(stats['lru_hits'], variants)
+        self.assertEqual(stats['misses'], 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.author)
+        cache.clear()
+
+
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = const.create_test_user()
+
+    def create_post(self, color):
+        content = BytesIO()
+        Image.new('RGB', (4, 4), color).save(content, 'PNG')
+        return const.create_test_post(
+            self.author, image=SimpleUploadedFile(
+                'upload.png', content.getvalue(), content_type='image/png'))
+
+    def test_same_content_stored_once(self):
+        """Одинаковые картинки — один файл, удаляемый с последним постом."""
+        first, second = self.create_post('blue'), self.create_post('blue')
+        other = self.create_post('green')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(first.image.name.startswith('posts/'))
+        storage = first.image.storage
+
+        first.delete()
+        self.assertFalse(release(second.image.name, Post.objects.all(),
+                                 grace=0))
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertTrue(release(second.image.name, Post.objects.all(),
+                                grace=0))
+        self.assertFalse(storage.exists(second.image.name))
+        self.assertTrue(storage.exists(other.image.name))
+
+    def test_concurrent_saves_of_same_content(self):
+        """Две одновременные загрузки одной картинки дают один файл."""
+        content = BytesIO()
+        Image.new('RGB', (4, 4), 'navy').save(content, 'PNG')
+        storage = Post._meta.get_field('image').storage
+        names = []
+        original_save = FileSystemStorage._save
+
+        def slow_save(self, name, content):
+            # Окно между проверкой и записью, в которое попадает второй.
+            time.sleep(0.05)
+            return original_save(self, name, content)
+
+        def upload():
+            names.append(storage.save(
+                'posts/upload.png', ContentFile(content.getvalue())))
+
+        threads = [threading.Thread(target=upload, daemon=True)
+                   for _ in range(2)]
+        with mock.patch.object(FileSystemStorage, '_save', slow_save):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(len(set(names)), 1)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(storage.exists(names[0]))
+        storage.delete(names[0])
+
+    def test_reused_file_survives_release(self):
+        """Файл, только что взятый новой загрузкой, не удаляется."""
+        first = self.create_post('yellow')
+        path = first.image.path
+        os.utime(path, (0, 0))
+        first.delete()
+        # Та же картинка загружается, пока пост с ней ещё не сохранён.
+        name = Post._meta.get_field('image').storage.save(
+            'posts/upload.png', first.image.file)
+        self.assertEqual(name, first.image.name)
+        self.assertFalse(release(name, Post.objects.all()))
+        self.assertTrue(os.path.exists(path))
+
+    def test_sweep_images(self):
+        orphan, kept = self.create_post('purple'), self.create_post('olive')
+        for post in (orphan, kept):
+            os.utime(post.image.path, (0, 0))
+        orphan.delete()
+        call_command('sweep_images', stdout=StringIO())
+        self.assertFalse(os.path.exists(orphan.image.path))
+        self.assertTrue(os.path.exists(kept.image.path))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.author)
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import constants as const
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.post = const.create_test_post(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing(self):
+        url = reverse('posts:home')
+        timing = self.client.get(url)['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('page;desc="hits=0 misses=1"', timing)
+        self.assertIn('cards;desc="hits=0 misses=1"', timing)
+        self.assertRegex(timing, r'total;dur=[\d.]+$')
+
+        timing = self.client.get(url)['Server-Timing']
+        self.assertIn('page;desc="hits=1 misses=0"', timing)
+        self.assertIn('db;dur=0.0;desc="0 queries"', timing)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        self.assertFalse(
+            self.client.get(reverse('posts:home')).has_header('Server-Timing'))
+
+    def test_sampled_profile(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PROFILING_SAMPLE_RATE=1,
+                                  PROFILING_DIR=directory):
+            self.client.get(reverse('posts:post_detail', args=[self.post.pk]))
+            dumps = os.listdir(directory)
+        self.assertEqual(len(dumps), 1)
+        self.assertRegex(dumps[0], r'-GET-posts_\d+-\d+ms\.prof$')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
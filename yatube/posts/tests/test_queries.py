@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from . import constants as const
+from ..models import Follow
+from ..views import POSTS_PER_PAGE
+
+
+class FeedQueryCountTests(TestCase):
+    """Число запросов ленты не зависит от количества постов на странице."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.author = const.create_test_user(username='author')
+        cls.another_author = const.create_test_user(username='another')
+        cls.group = const.create_test_group()
+        cls.another_group = const.create_test_group('Другая группа',
+                                                    'another-slug')
+        for i in range(POSTS_PER_PAGE):
+            const.create_test_post(
+                cls.author if i % 2 else cls.another_author,
+                cls.group if i % 3 else cls.another_group,
+            )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Follow.objects.create(user=cls.user, author=cls.another_author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_feed_query_counts(self):
+        # Сессия и пользователь дают два запроса авторизованному клиенту.
+        views_queries = {
+            reverse('posts:home'): 3,
+            reverse('posts:group_list', args=[self.group.slug]): 4,
+            reverse('posts:profile', args=[self.author.username]): 5,
+            reverse('posts:follow_index'): 3,
+        }
+        for url, expected in views_queries.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(expected):
+                    self.authorized_client.get(url)
+
+    def test_post_card_has_no_lazy_relations(self):
+        response = self.authorized_client.get(reverse('posts:home'))
+        for post in response.context['page_obj']:
+            self.assertIn('author', post._state.fields_cache)
+            self.assertIn('group', post._state.fields_cache)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_group(cls.group)
+        const.delete_test_group(cls.another_group)
+        const.delete_test_user(cls.user)
+        const.delete_test_user(cls.author)
+        const.delete_test_user(cls.another_author)
@@ -0,0 +1,71 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .. import caching
+from ..caching import cache_feed
+from ..models import Post
+from ..routers import PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=7)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def serve(self, request, write=False):
+        """Ответ и базы чтения до и после записи внутри запроса."""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Post))
+            if write:
+                self.router.db_for_write(Post)
+            reads.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        return ReplicaPinMiddleware(view)(request), reads
+
+    def test_reads_go_to_replica(self):
+        response, reads = self.serve(self.factory.get('/'))
+        self.assertEqual(reads, ['replica', 'replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_write_pins_reader_to_primary(self):
+        response, reads = self.serve(self.factory.post('/'), write=True)
+        self.assertEqual(reads, ['replica', DEFAULT_DB_ALIAS])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 7)
+
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        response, reads = self.serve(request)
+        self.assertEqual(reads, [DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS])
+
+    def test_cached_pages_render_from_replica(self):
+        """Промах кеша читает реплику, пока поколение не сменилось."""
+        cache.clear()
+        reads = []
+
+        @cache_feed(60, 'router_test')
+        def view(request):
+            reads.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        ReplicaPinMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(reads, ['replica'])
+
+        # Сразу после изменения реплика может отставать.
+        caching.bump(caching.GROUPS)
+        ReplicaPinMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(reads, ['replica', DEFAULT_DB_ALIAS])
+
+    def test_writes_and_migrations_use_primary(self):
+        self.assertEqual(self.router.db_for_write(Post), DEFAULT_DB_ALIAS)
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'posts'))
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Post), DEFAULT_DB_ALIAS)
@@ -0,0 +1,102 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from . import constants as const
+from ..models import Post
+from .. import search
+from ..search import SEARCH_TABLE, tokenize
+from ..views import POSTS_PER_PAGE
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.post = Post.objects.create(
+            author=cls.user, text='Читаю интересные книги по вечерам')
+        cls.relevant_post = Post.objects.create(
+            author=cls.user, text='Книга о книгах: лучшие книги года')
+        cls.other_post = Post.objects.create(
+            author=cls.user, text='Гуляли в парке')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search_results'),
+                                   {'query': query})
+        return list(response.context['object_list'])
+
+    def test_tokenize_russian(self):
+        self.assertEqual(tokenize('Книгами'), tokenize('книга'))
+        self.assertEqual(tokenize('Ёлки, Django!'), ['елк', 'django'])
+
+    def test_search_by_word_form_and_rank(self):
+        self.assertEqual(self.search('книгами'),
+                         [self.relevant_post, self.post])
+        self.assertEqual(self.search('интересная книга'), [self.post])
+        self.assertEqual(self.search('парк'), [self.other_post])
+
+    def test_search_index_follows_edit_and_delete(self):
+        post = Post.objects.get(pk=self.other_post.pk)
+        post.text = 'Катались на велосипеде'
+        post.save()
+        self.assertEqual(self.search('парк'), [])
+        self.assertEqual(self.search('велосипед'), [post])
+
+        post.delete()
+        self.assertEqual(self.search('велосипед'), [])
+
+    def test_search_query_syntax_is_escaped(self):
+        for query in ('"', 'NOT книга', 'книг* OR', '(', ''):
+            with self.subTest(query=query):
+                self.search(query)
+
+    def test_rebuild_search_index_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        self.assertEqual(self.search('книги'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('книги'),
+                         [self.relevant_post, self.post])
+
+    def test_search_results_paginated_and_cached(self):
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Ещё одна книга номер {i}')
+            for i in range(POSTS_PER_PAGE + 2))
+        call_command('rebuild_search_index', stdout=StringIO())
+        url = reverse('posts:search_results')
+
+        response = self.client.get(url, {'query': 'книга'})
+        self.assertEqual(len(response.context['page_obj']), POSTS_PER_PAGE)
+        self.assertEqual(response.context['paginator'].count,
+                         POSTS_PER_PAGE + 4)
+        self.assertContains(response, 'query=%D0%BA%D0%BD%D0%B8%D0%B3%D0%B0'
+                                      '&amp;page=2')
+
+        response = self.client.get(url, {'query': 'книга', 'page': 2})
+        self.assertEqual(len(response.context['page_obj']), 4)
+
+        # Повторный популярный запрос не обращается к базе.
+        with self.assertNumQueries(0):
+            self.client.get(url, {'query': 'книга'})
+
+    def test_search_hit_count_capped(self):
+        with mock.patch.object(search, 'SEARCH_RESULTS_LIMIT', 1):
+            response = self.client.get(reverse('posts:search_results'),
+                                       {'query': 'книга'})
+        self.assertTrue(response.context['hits_capped'])
+        self.assertEqual(response.context['paginator'].count, 1)
+        self.assertContains(response, 'более 1')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
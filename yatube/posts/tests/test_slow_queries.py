@@ -0,0 +1,109 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import constants as const
+from .. import slow_queries
+
+
+@override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_DB=None)
+class SlowQueryTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+        cls.post = const.create_test_post(cls.user)
+
+    def setUp(self):
+        cache.clear()
+        slow_queries.reset()
+        self.addCleanup(slow_queries.reset)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                "SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2, 3) "
+                "AND c = %s"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?')
+
+    def test_records_view_and_origin(self):
+        with self.assertLogs('posts.slow_queries', 'WARNING'):
+            self.client.get(reverse('posts:post_detail',
+                                    args=[self.post.pk]))
+        entries = slow_queries.top(100)
+        self.assertTrue(entries)
+        self.assertEqual({entry['view'] for entry in entries},
+                         {'posts:post_detail'})
+        self.assertTrue(any(entry['origin'].startswith('posts/')
+                            for entry in entries))
+
+    def test_shared_database(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(
+                    SLOW_QUERY_DB=os.path.join(directory, 'slow.db')), \
+                self.assertLogs('posts.slow_queries', 'WARNING'):
+            for ms in (5, 20):
+                slow_queries.record('SELECT 1 WHERE 1 = %s', [ms], ms,
+                                    'posts:home')
+                slow_queries.flush()
+            [entry] = slow_queries.top()
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(entry['total_ms'], 25)
+        self.assertEqual(entry['max_ms'], 20)
+        self.assertIsNone(entry['params'])
+        self.assertEqual(slow_queries.example_params(entry), [None])
+
+    def test_params_not_persisted(self):
+        """Значения параметров не попадают в общий файл."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.db')
+            with override_settings(SLOW_QUERY_DB=path), \
+                    self.assertLogs('posts.slow_queries', 'WARNING'):
+                slow_queries.record(
+                    'SELECT * FROM django_session WHERE session_key = %s',
+                    ['secret-session-key'], 500, 'posts:home')
+                slow_queries.flush()
+            for name in os.listdir(directory):
+                with open(os.path.join(directory, name), 'rb') as file:
+                    self.assertNotIn(b'secret-session-key', file.read())
+
+    def test_failed_flush_keeps_entries(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(SLOW_QUERY_DB=directory), \
+                self.assertLogs('posts.slow_queries', 'WARNING') as logs:
+            for ms in (5, 20):
+                slow_queries.record('SELECT 2 WHERE 2 = %s', [ms], ms,
+                                    'posts:home')
+                slow_queries.flush()
+        self.assertIn('ERROR', {record.levelname for record in logs.records})
+        [entry] = slow_queries.top()
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(entry['total_ms'], 25)
+        self.assertEqual(entry['params'], '[20]')
+
+    def test_explain_flags_scans(self):
+        plan = slow_queries.explain(
+            connection, 'SELECT * FROM posts_post ORDER BY text', [])
+        warnings = {warning for _, warning in plan}
+        self.assertIn('полный проход по таблице', warnings)
+        self.assertIn('сортировка во временном B-дереве', warnings)
+        self.assertEqual(slow_queries.explain(
+            connection, 'DELETE FROM posts_post', []), [])
+
+    def test_command(self):
+        output = StringIO()
+        call_command('explain_queries', url=[reverse('posts:home')],
+                     stdout=output)
+        self.assertIn('posts:home', output.getvalue())
+        self.assertIn('posts_post', output.getvalue())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import tempfile
+
+from django.db import connection
+from django.test import SimpleTestCase
+
+from .. import sqlite
+
+
+class SQLitePragmaTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_connection_pragmas(self):
+        connection.ensure_connection()
+        db = connection.connection
+        self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(db.execute('PRAGMA busy_timeout').fetchone()[0],
+                         5000)
+        self.assertEqual(db.execute('PRAGMA cache_size').fetchone()[0],
+                         -64 * 1024)
+
+    def test_journal_mode_set_once(self):
+        """Соединение не трогает режим журнала, он хранится в файле."""
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = connection.copy()
+            wrapper.settings_dict = {
+                **wrapper.settings_dict,
+                'NAME': os.path.join(directory, 'db.sqlite3')}
+            modes = []
+            for _ in range(2):
+                wrapper.ensure_connection()
+                try:
+                    modes.append(wrapper.connection.execute(
+                        'PRAGMA journal_mode').fetchone()[0])
+                    sqlite.set_journal_mode(wrapper, 'WAL')
+                finally:
+                    wrapper.close()
+        self.assertEqual(modes, ['delete', 'wal'])
+
+    def test_apply_pragmas(self):
+        db = sqlite3.connect(':memory:')
+        executed = []
+        db.set_trace_callback(executed.append)
+        sqlite.apply_pragmas(db, {'temp_store': 'MEMORY',
+                                  'busy_timeout': 100})
+        self.assertEqual(db.execute('PRAGMA temp_store').fetchone()[0], 2)
+        self.assertEqual(executed[0], 'PRAGMA busy_timeout = 100')
+        db.close()
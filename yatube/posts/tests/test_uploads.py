@@ -0,0 +1,68 @@
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import constants as const
+from .. import uploads
+from ..models import Post
+
+
+def png(width, height):
+    content = BytesIO()
+    Image.new('RGB', (width, height), 'white').save(content, 'PNG')
+    return content.getvalue()
+
+
+class UploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = const.create_test_user()
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def create_post(self, content):
+        return self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('big.png', content, 'image/png'),
+        })
+
+    def test_oversize_uploads_rejected(self):
+        """Большие файлы и картинки отклоняются с ошибкой в форме."""
+        limits = (
+            ({'UPLOAD_MAX_PIXELS': 20 * 20 - 1}, 'слишком велика'),
+            ({'UPLOAD_MAX_BYTES': 10}, 'Файл больше'),
+        )
+        for limit, error in limits:
+            with self.subTest(limit=limit), override_settings(**limit):
+                response = self.create_post(png(20, 20))
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(error,
+                              response.context['form'].errors['image'][0])
+                self.assertFalse(Post.objects.exists())
+
+    def test_downsize(self):
+        """Крупный оригинал заменяется уменьшенным у всех постов."""
+        post = const.create_test_post(self.user, image=SimpleUploadedFile(
+            'wide.png', png(60, 30), 'image/png'))
+        original = post.image.name
+        with override_settings(POST_IMAGE_MAX_SIDE=20,
+                               POST_IMAGE_RELEASE_GRACE=0):
+            name = uploads.downsize(original)
+            self.assertEqual(uploads.downsize(name), name)
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual((post.image.width, post.image.height), (20, 10))
+        self.assertFalse(post.image.storage.exists(original))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        const.delete_test_user(cls.user)
@@ -0,0 +1,346 @@
+"""
+Предварительная генерация миниатюр картинок постов.
+
+Для каждого размера из settings.POST_THUMBNAILS создаются варианты
+нескольких ширин в каждом формате из settings.POST_IMAGE_FORMATS (WebP,
+AVIF — если их поддерживает установленный Pillow), которые шаблоны
+отдают через srcset. Варианты создаются в фоновом пуле потоков после
+сохранения поста с картинкой, а не при первом показе страницы. Пока
+готовы не все варианты, шаблоны показывают оригинал (см. тег
+post_thumbnail); миниатюры картинок, загруженных раньше, создаёт
+команда warm_thumbnails.
+
+Поиск готовых миниатюр не обращается к файловой системе: метаданные
+берутся из LRU-кеша процесса (THUMBNAIL_LRU_SIZE записей), затем одним
+get_many из кеша KV-хранилища sorl и лишь в последнюю очередь из его
+таблицы в БД. Счётчики попаданий возвращает lookup_stats().
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+
+from . import metrics, profiling, uploads
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+Image.init()
+
+# Расширения файлов для форматов, которых не знает sorl.
+FORMAT_EXTENSIONS = {**EXTENSIONS, 'AVIF': 'avif'}
+
+_executor = None
+# Картинки, уже стоящие в очереди: повторные показы страницы до
+# готовности миниатюр не ставят их в очередь снова.
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+class Variant(NamedTuple):
+    format: str
+    width: int
+    geometry: str
+    options: dict
+
+
+class PostThumbnailBackend(ThumbnailBackend):
+    """
+    Бэкенд sorl, умеющий вычислить файл миниатюры, не создавая её, и
+    сохранять миниатюры в AVIF.
+    """
+
+    def _get_thumbnail_filename(self, source, geometry_string, options):
+        key = tokey(source.key, geometry_string, serialize(options))
+        return (f'{thumbnail_settings.THUMBNAIL_PREFIX}'
+                f'{key[:2]}/{key[2:4]}/{key}.'
+                f'{FORMAT_EXTENSIONS[options["format"]]}')
+
+    def _thumbnail_file(self, file_, geometry_string, options):
+        # Повторяет подготовку опций из ThumbnailBackend.get_thumbnail,
+        # чтобы имя файла совпадало с тем, что создаст sorl.
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+
+backend = PostThumbnailBackend()
+
+
+class LRUCache:
+    """Потокобезопасный словарь, вытесняющий давно не читанные ключи."""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Запоминаются только найденные миниатюры: отсутствующую может в любой
+# момент создать фоновый пул, а существующая под тем же ключом не
+# меняется (ключ включает имя картинки, геометрию и опции).
+_lookups = LRUCache(settings.THUMBNAIL_LRU_SIZE)
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(**counts):
+    with _stats_lock:
+        _stats.update(counts)
+    misses = counts.pop('misses', 0)
+    profiling.count('thumbnail_misses', misses)
+    profiling.count('thumbnail_hits', sum(counts.values()))
+
+
+def lookup_stats() -> dict:
+    """
+    Счётчики поиска миниатюр в этом процессе: попадания в LRU-кеш,
+    в кеш KV-хранилища, в его таблицу, промахи и доля попаданий.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    for counter in ('lru_hits', 'cache_hits', 'db_hits', 'misses'):
+        stats.setdefault(counter, 0)
+    total = sum(stats.values())
+    stats['hit_rate'] = (total - stats['misses']) / total if total else 0.0
+    return stats
+
+
+def clear_lookups() -> None:
+    _lookups.clear()
+    with _stats_lock:
+        _stats.clear()
+
+
+def image_formats() -> list:
+    """Форматы из POST_IMAGE_FORMATS, которые умеет сохранять Pillow."""
+    return [image_format for image_format in settings.POST_IMAGE_FORMATS
+            if image_format in Image.SAVE]
+
+
+def variants(name) -> list:
+    """Все варианты миниатюры размера name: форматы × ширины."""
+    spec = settings.POST_THUMBNAILS[name]
+    width, height = spec['size']
+    return [
+        Variant(image_format, variant_width,
+                f'{variant_width}x{round(height * variant_width / width)}',
+                {**spec['options'], 'format': image_format,
+                 'quality': settings.POST_IMAGE_FORMATS[image_format]})
+        for image_format in image_formats()
+        for variant_width in spec['widths']
+    ]
+
+
+class Picture:
+    """
+    Готовые варианты картинки для тега <picture>: современные форматы
+    в sources, последний (запасной) формат — в src и srcset тега <img>.
+    """
+
+    def __init__(self, name, found):
+        self.sizes = settings.POST_THUMBNAILS[name]['sizes']
+        srcsets = {}
+        for variant, thumbnail in found:
+            srcsets.setdefault(variant.format, []).append(
+                f'{thumbnail.url} {variant.width}w')
+        *modern, fallback = srcsets
+        self.sources = [(f'image/{image_format.lower()}',
+                         ', '.join(srcsets[image_format]))
+                        for image_format in modern]
+        self.srcset = ', '.join(srcsets[fallback])
+        variant, largest = max(
+            ((variant, thumbnail) for variant, thumbnail in found
+             if variant.format == fallback),
+            key=lambda pair: pair[0].width)
+        self.src = largest.url
+        self.width, self.height = largest.width, largest.height
+
+
+def _lookup(keys) -> dict:
+    """Находит миниатюры по ключам KV-хранилища: {ключ: ImageFile}."""
+    found = {}
+    for key in keys:
+        thumbnail = _lookups.get(key)
+        if thumbnail is not None:
+            found[key] = thumbnail
+    _count(lru_hits=len(found))
+
+    missing = [key for key in keys if key not in found]
+    kv_cache = getattr(default.kvstore, 'cache', None)
+    cached = kv_cache.get_many(missing) if kv_cache and missing else {}
+    for key in missing:
+        value = cached.get(key)
+        if value is EMPTY_VALUE:
+            # sorl уже знает, что миниатюры нет: в БД не идём.
+            _count(misses=1)
+            continue
+        if value is not None:
+            _count(cache_hits=1)
+            thumbnail = deserialize_image_file(value)
+        else:
+            thumbnail = default.kvstore._get(del_prefix(key))
+            _count(**{'db_hits' if thumbnail else 'misses': 1})
+        if thumbnail is not None:
+            found[key] = thumbnail
+            _lookups.set(key, thumbnail)
+    return found
+
+
+def resolve(images, name) -> list:
+    """
+    Готовые варианты размера name для списка картинок (Picture или
+    None, если создан не каждый вариант) за одно обращение к кешу на
+    весь список.
+    """
+    image_variants = variants(name)
+    keys = [
+        [add_prefix(backend._thumbnail_file(image, variant.geometry,
+                                            dict(variant.options)).key)
+         for variant in image_variants]
+        for image in images
+    ]
+    found = _lookup(set(key for image_keys in keys for key in image_keys))
+    pictures = []
+    for image_keys in keys:
+        if all(key in found for key in image_keys):
+            pictures.append(Picture(name, [
+                (variant, found[key])
+                for variant, key in zip(image_variants, image_keys)]))
+        else:
+            pictures.append(None)
+    return pictures
+
+
+def prefetch(posts, name) -> None:
+    """Находит миниатюры картинок всех постов страницы разом."""
+    posts = [post for post in posts if post.image]
+    if not posts:
+        return
+    pictures = resolve([post.image for post in posts], name)
+    for post, picture in zip(posts, pictures):
+        post.__dict__.setdefault('_pictures', {})[name] = picture
+
+
+def cached_picture(image, name):
+    prefetched = image.instance.__dict__.get('_pictures', {})
+    if name in prefetched:
+        return prefetched[name]
+    return resolve([image], name)[0]
+
+
+def generate(image_name) -> int:
+    """Создаёт все варианты миниатюр картинки, возвращает их число."""
+    # Хранилище поля, а не хранилище по умолчанию: от него зависят
+    # ключи миниатюр в sorl.
+    image = ImageFile(image_name, Post._meta.get_field('image').storage)
+    started = time.perf_counter()
+    generated = 0
+    for name in settings.POST_THUMBNAILS:
+        for variant in variants(name):
+            try:
+                backend.get_thumbnail(image, variant.geometry,
+                                      **variant.options)
+                generated += 1
+            except Exception:
+                logger.exception('Не удалось создать миниатюру %s %s для %s',
+                                 name, variant.geometry, image_name)
+    metrics.THUMBNAILS.inc(generated)
+    metrics.THUMBNAIL_DURATION.observe(time.perf_counter() - started)
+    return generated
+
+
+def process(image_name) -> int:
+    """Уменьшает слишком крупный оригинал и создаёт его миниатюры."""
+    try:
+        image_name = uploads.downsize(image_name)
+    except Exception:
+        logger.exception('Не удалось уменьшить картинку %s', image_name)
+    return generate(image_name)
+
+
+def _generate_in_worker(image_name):
+    try:
+        process(image_name)
+    finally:
+        with _pending_lock:
+            _pending.discard(image_name)
+        close_old_connections()
+
+
+def _submit(image_name):
+    if not settings.THUMBNAIL_WORKERS:
+        # Без пула миниатюры создаются сразу после коммита: так
+        # разработка и тесты не зависят от фоновых потоков.
+        with profiling.timed('thumbnails'):
+            process(image_name)
+        return
+    with _pending_lock:
+        if image_name in _pending:
+            return
+        _pending.add(image_name)
+    _get_executor().submit(_generate_in_worker, image_name)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails')
+    return _executor
+
+
+def schedule(image) -> None:
+    """
+    Ставит генерацию миниатюр картинки в очередь после коммита
+    транзакции, в которой сохранён пост.
+    """
+    if not image:
+        return
+    if all(cached_picture(image, name) for name in settings.POST_THUMBNAILS):
+        # Та же картинка уже загружалась: файл и миниатюры общие.
+        return
+    image_name = image.name
+    transaction.on_commit(lambda: _submit(image_name))
@@ -0,0 +1,61 @@
+"""
+Материализованная лента подписок (fan-out on write).
+
+При публикации пост раскладывается по лентам всех подписчиков автора,
+поэтому follow_index читает ленту пользователя одним диапазоном индекса
+(user, pub_date, post) вместо слияния постов всех авторов.
+"""
+
+from django.conf import settings
+
+from .models import Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+
+
+def is_enabled() -> bool:
+    return settings.FOLLOW_TIMELINE
+
+
+def fan_out(post: Post) -> None:
+    """Добавляет пост в ленты подписчиков его автора."""
+    followers = post.author.following.values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user, author) -> None:
+    """Заполняет ленту пользователя постами автора после подписки."""
+    posts = author.posts.order_by().values_list('id', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user=user, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def trim(user, author) -> None:
+    """Убирает посты автора из ленты пользователя после отписки."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def rebuild(users=None) -> int:
+    """
+    Пересобирает ленты заданных пользователей (по умолчанию всех)
+    по текущим подпискам. Возвращает число записей в пересобранных лентах.
+    """
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.select_related('user', 'author')
+    if users is not None:
+        entries = entries.filter(user__in=users)
+        follows = follows.filter(user__in=users)
+    entries.delete()
+    for follow in follows.iterator():
+        backfill(follow.user, follow.author)
+    return TimelineEntry.objects.filter(
+        user__in=follows.values('user')).count()
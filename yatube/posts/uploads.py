@@ -0,0 +1,151 @@
+"""
+Приём загружаемых картинок без лишних затрат памяти.
+
+Загрузки пишутся кусками во временный файл (FILE_UPLOAD_HANDLERS в
+настройках), а BoundedImageUploadHandler по дороге проверяет размер
+файла и, по заголовку картинки, её размеры в пикселях: слишком большой
+файл или «бомба распаковки» отбрасываются, не дочитанными и не
+распакованными. Причина отказа попадает в ошибки формы (add_errors).
+
+Слишком крупные оригиналы уменьшаются до POST_IMAGE_MAX_SIDE уже после
+сохранения поста, в фоне вместе с генерацией миниатюр (downsize).
+"""
+
+import logging
+import os
+import time
+from io import BytesIO
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from PIL import Image
+
+from . import caching, metrics, storage
+from .models import Post
+
+# Сколько байт начала файла ждать, пока в них не найдётся заголовок.
+HEADER_MAX_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def _peak_memory_kb() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def image_size(head: bytes):
+    """Размеры картинки по началу файла или None, если их там нет."""
+    try:
+        with Image.open(BytesIO(head)) as image:
+            return image.size
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+class BoundedImageUploadHandler(FileUploadHandler):
+    """
+    Отбрасывает загрузки больше UPLOAD_MAX_BYTES и картинки больше
+    UPLOAD_MAX_PIXELS, передавая остальные данные следующему
+    обработчику, и пишет в лог объём, время и прирост памяти по каждой
+    загрузке.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = b''
+        self.checked = False
+        self.started = time.perf_counter()
+        self.memory = _peak_memory_kb()
+
+    def reject(self, message):
+        self.request.upload_errors = {
+            **getattr(self.request, 'upload_errors', {}),
+            self.field_name: message,
+        }
+        logger.info('Загрузка %s отклонена: %s', self.file_name, message)
+        metrics.UPLOADS.inc(result='rejected')
+        raise SkipFile(message)
+
+    def check_header(self, final=False):
+        try:
+            size = image_size(self.head)
+        except Image.DecompressionBombError:
+            self.reject('Картинка слишком велика.')
+        if size is None and not final and self.received < HEADER_MAX_BYTES:
+            return
+        self.checked = True
+        self.head = b''
+        if size and size[0] * size[1] > settings.UPLOAD_MAX_PIXELS:
+            self.reject(f'Картинка {size[0]}×{size[1]} слишком велика.')
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_BYTES:
+            self.reject('Файл больше '
+                        f'{filesizeformat(settings.UPLOAD_MAX_BYTES)}.')
+        if not self.checked:
+            self.head += raw_data
+            self.check_header()
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            self.check_header(final=True)
+        logger.info(
+            'Загрузка %s: %d байт за %.3f с, пиковая память +%d КБ',
+            self.file_name, file_size, time.perf_counter() - self.started,
+            _peak_memory_kb() - self.memory)
+        metrics.UPLOADS.inc(result='accepted')
+        metrics.UPLOAD_BYTES.inc(file_size)
+        return None
+
+
+def add_errors(form, request) -> None:
+    """Добавляет в форму ошибки загрузок, отклонённых обработчиком."""
+    for field, message in getattr(request, 'upload_errors', {}).items():
+        form.add_error(field, message)
+
+
+def downsize(image_name) -> str:
+    """
+    Уменьшает оригинал больше POST_IMAGE_MAX_SIDE и переводит на него
+    все посты. Возвращает имя файла, по которому строить миниатюры.
+    """
+    field = Post._meta.get_field('image')
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    started = time.perf_counter()
+    with field.storage.open(image_name) as file, Image.open(file) as image:
+        if max(image.size) <= max_side:
+            return image_name
+        image_format = image.format
+        # EXIF сохраняется ради ориентации снимка.
+        options = {'exif': image.info['exif']} if 'exif' in image.info else {}
+        image.draft(image.mode, (max_side, max_side))
+        image.thumbnail((max_side, max_side))
+        content = BytesIO()
+        image.save(content, image_format, **options)
+    new_name = field.storage.save(
+        field.generate_filename(None, os.path.basename(image_name)),
+        ContentFile(content.getvalue()))
+    # update() не посылает сигналов: старый файл упоминается в
+    # закешированных страницах и карточках, а смена поколения GROUPS
+    # сбрасывает их все.
+    Post.objects.filter(image=image_name).update(
+        image=new_name, updated=timezone.now())
+    caching.bump(caching.GROUPS)
+    storage.release(image_name, Post.objects.all())
+    metrics.DOWNSIZED.inc()
+    logger.info('Картинка %s уменьшена до %s за %.3f с', image_name,
+                new_name, time.perf_counter() - started)
+    return new_name
@@ -16,6 +16,11 @@ urlpatterns = [
     path(
         'posts/<int:post_id>/comment/', views.add_comment, name='add_comment'
     ),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path('follow/', views.follow_index, name='follow_index'),
     path(
         'profile/<str:username>/follow/',
@@ -27,4 +32,5 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
@@ -1,25 +1,55 @@
-from django.core.paginator import Paginator
+import hmac
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView
-from django.views.decorators.cache import cache_page
 
 from .models import Post, Group, Comment, Follow, User
 from .forms import PostForm, CommentForm
+from .paginator import CountedPaginator, KeysetPaginator
+from . import (caching, counters, metrics, search, thumbnails, timeline,
+               uploads)
 
 
 POSTS_PER_PAGE = 10
-CACH_TIME = 20
+# Больше комментариев за раз не отдаёт ни страница поста, ни подгрузка.
+COMMENTS_PER_PAGE = 20
+# Страницы лент инвалидируются сигналами (см. posts.caching), поэтому
+# при общем кеше время жизни ограничивает только объём памяти под
+# устаревшие записи. С кешем процесса оно сокращается до
+# LOCAL_PAGE_CACHE_TIME.
+CACH_TIME = 60 * 60 * 3
+
+
+def get_page_obj(request, post_list, total, on_exact=None):
+    """
+    Возвращает страницу ленты постов. Режим паджинации задаётся
+    настройкой POSTS_PAGINATION: 'keyset' — по курсору, 'pages' — по номеру.
+    total — функция, возвращающая размер ленты из счётчиков вместо
+    COUNT(*), on_exact получает точный размер, если total ошиблась (см.
+    CountedPaginator).
+    """
+    page_number = request.GET.get('page')
+    if settings.POSTS_PAGINATION == 'keyset':
+        paginator = KeysetPaginator(post_list, POSTS_PER_PAGE)
+        return paginator.get_page(request.GET.get('cursor'), page_number)
+    paginator = CountedPaginator(post_list, POSTS_PER_PAGE, total, on_exact)
+    return paginator.get_page(page_number)
 
 
-@cache_page(CACH_TIME, key_prefix='index_page')
+@caching.cache_feed(CACH_TIME, 'index_page',
+                    lambda: [caching.FEED])
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = Post.objects.feed()
+    page_obj = get_page_obj(request, post_list, counters.feed_total,
+                            counters.set_feed_total)
     context = {
         'title': 'Последние обновления на сайте',
         'header': 'Это главная страница сайта Yatube',
@@ -28,13 +58,13 @@ def index(request):
     return render(request, template, context)
 
 
+@caching.cache_feed(CACH_TIME, 'group_page',
+                    lambda slug: [caching.group_scope(slug)])
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = group.posts.feed()
+    page_obj = get_page_obj(request, post_list, lambda: group.posts_count)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -42,39 +72,87 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@caching.cache_feed(CACH_TIME, 'profile_page',
+                    lambda username: [caching.author_scope(username)])
 def profile(request, username):
-    author = get_object_or_404(get_user_model(), username=username)
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    author = get_object_or_404(
+        get_user_model().objects.select_related('stats'), username=username)
+    author_stats = counters.stats_for(author)
+    post_list = author.posts.feed()
+    page_obj = get_page_obj(request, post_list,
+                            lambda: author_stats.posts_count)
     following = False
     if request.user.is_authenticated:
         following = Follow.objects.filter(
             user=request.user, author=author).exists()
     context = {
         'author': author,
+        'author_stats': author_stats,
         'page_obj': page_obj,
         'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@caching.cache_feed(CACH_TIME, 'post_detail_page',
+                    lambda post_id: [caching.FEED])
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = Comment.objects.filter(post=post)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
+    comments_page = get_comments_page(request, post)
     form = CommentForm()
     context = {
         'post': post,
+        'author_stats': counters.stats_for(post.author),
         'form': form,
-        'comments': comments
+        'comments_page': comments_page,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def get_comments_page(request, post):
+    """
+    Страница комментариев поста, от новых к старым. Следующие страницы
+    выбираются по курсору ?cursor=, как и ленты в режиме 'keyset'.
+    """
+    comments = Comment.objects.filter(post=post).select_related(
+        'author').order_by('-created', '-id')
+    paginator = KeysetPaginator(comments, COMMENTS_PER_PAGE)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+@caching.cache_feed(CACH_TIME, 'comments_page',
+                    lambda post_id: [caching.FEED])
+def post_comments(request, post_id):
+    """
+    Следующая страница комментариев для подгрузки на странице поста:
+    фрагмент HTML или, с ?format=json, JSON.
+    """
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
+    comments_page = get_comments_page(request, post)
+    if request.GET.get('format') != 'json':
+        return render(request, 'posts/includes/comments.html', {
+            'post': post, 'comments_page': comments_page})
+    next_url = None
+    if comments_page.has_next():
+        next_url = (reverse('posts:post_comments', args=[post.id])
+                    + '?format=json&cursor='
+                    + comments_page.paginator.next_cursor)
+    return JsonResponse({
+        'comments': [{
+            'id': comment.id,
+            'author': comment.author.username,
+            'text': comment.text,
+            'created': comment.created.isoformat(),
+        } for comment in comments_page],
+        'next': next_url,
+    })
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
+    uploads.add_errors(form, request)
     if request.method != 'POST' or not form.is_valid():
         return render(
             request, 'posts/create_post.html', context={'form': form}
@@ -82,6 +160,7 @@ def post_create(request):
     post = form.save(commit=False)
     post.author = request.user
     post.save()
+    thumbnails.schedule(post.image)
     return redirect('posts:profile', username=request.user.username)
 
 
@@ -93,8 +172,11 @@ def post_edit(request, post_id):
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
                     instance=post)
+    uploads.add_errors(form, request)
     if request.method == 'POST' and form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post.image)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -103,18 +185,24 @@ def post_edit(request, post_id):
     return render(request, 'posts/create_post.html', context)
 
 
+@method_decorator(
+    caching.cache_feed(search.SEARCH_CACHE_TIME, 'search_page',
+                       lambda: [caching.FEED]),
+    name='dispatch')
 class SearchResultsView(ListView):
     model = Post
     template_name = 'posts/search_results.html'
+    paginate_by = POSTS_PER_PAGE
 
     def get_queryset(self):
         query = self.request.GET.get('query', '')
-        object_list = Post.objects.filter(text__icontains=query)
-        return object_list
+        return search.search(Post.objects.all(), query)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['query'] = self.request.GET.get('query', '')
+        context['query_prefix'] = urlencode({'query': context['query']}) + '&'
+        context['hits_capped'] = getattr(self.object_list, 'capped', False)
         return context
 
 
@@ -133,12 +221,18 @@ def add_comment(request, post_id):
 @login_required
 def follow_index(request):
     user = request.user
-    following = Follow.objects.filter(
-        user=user).select_related('author').values('author')
-    post_list = Post.objects.filter(author__in=following)
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if timeline.is_enabled():
+        entries = user.timeline.select_related(
+            'post__author', 'post__group')
+        page_obj = get_page_obj(request, entries,
+                                lambda: counters.follow_total(user))
+        page_obj.object_list = [entry.post for entry in page_obj]
+    else:
+        following = Follow.objects.filter(
+            user=user).select_related('author').values('author')
+        post_list = Post.objects.feed().filter(author__in=following)
+        page_obj = get_page_obj(request, post_list,
+                                lambda: counters.follow_total(user))
     context = {
         'title': 'Ваши подписки',
         'header': 'Посты от авторов, на которых Вы подписаны',
@@ -161,5 +255,24 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=user, author=author).delete()
+    # Сигналы удаления обращаются к подписчику и автору: подставляем
+    # уже загруженные объекты, чтобы не читать их заново.
+    for follow in Follow.objects.filter(user=user, author=author):
+        follow.user, follow.author = user, author
+        follow.delete()
     return redirect('posts:profile', username=username)
+
+
+def metrics_view(request):
+    """
+    Метрики для Prometheus. Страница видна персоналу, а сборщику — по
+    токену METRICS_TOKEN в заголовке Authorization: Bearer или с
+    адресов из METRICS_ALLOWED_IPS; остальным отвечает 404.
+    """
+    token = settings.METRICS_TOKEN
+    collector = bool(token) and hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    trusted = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not (collector or trusted or request.user.is_staff):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.profiling.ProfilingMiddleware',
+    'posts.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,7 +67,7 @@ ROOT_URLCONF = 'yatube.urls'
 TAMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'posts.profiling.ProfiledDjangoTemplates',
         'DIRS': [TAMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -86,13 +88,48 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Соединение воркера живёт CONN_MAX_AGE секунд, а не один запрос.
+# Включается переменной окружения при запуске воркеров, например
+# DB_CONN_MAX_AGE=600 gunicorn yatube.wsgi. По умолчанию выключено:
+# runserver обрабатывает каждый запрос в новом потоке, и постоянные
+# соединения там только копились бы.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
     }
 }
 
+# Реплики только для чтения — псевдонимы из DATABASES (см.
+# posts.routers). REPLICA_PIN_SECONDS — ожидаемое отставание реплик:
+# столько секунд записавший что-то пользователь читает из основной базы,
+# и столько же после смены поколения страницы лент для кеша
+# отрисовываются по ней. На одной машине реплику заменяет копия
+# базы, которую обновляет команда sync_replicas:
+# DATABASES['replica'] = {
+#     **DATABASES['default'],
+#     'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+#     'TEST': {'MIRROR': 'default'},
+# }
+# DATABASE_REPLICAS = ['replica']
+DATABASE_ROUTERS = ['posts.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+
+# Прагмы каждого нового соединения с SQLite (см. posts.sqlite). Режим
+# журнала SQLITE_JOURNAL_MODE хранится в файле базы и включается один
+# раз миграцией.
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение — размер в КБ, а не в страницах.
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -147,10 +184,120 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кеш процесса подходит для разработки. Страницы лент сбрасываются
+# поколениями в кеше (см. posts.caching), и при нескольких воркерах
+# кеш должен быть общим, например:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+# С LocMemCache страницы лент хранятся не дольше LOCAL_PAGE_CACHE_TIME
+# секунд: изменения из другого воркера видны не позже этого срока.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+LOCAL_PAGE_CACHE_TIME = 20
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
+
+# Режим паджинации лент постов: 'keyset' — переход по курсору без COUNT(*)
+# и OFFSET, 'pages' — классическая нумерация страниц.
+POSTS_PAGINATION = 'keyset'
+
+# Размеры лент для паджинации по номерам берутся из счётчиков, а не из
+# COUNT(*) (см. posts.counters): суммы по подпискам и главная лента
+# хранятся в кеше FEED_COUNT_TIMEOUT секунд. Главная лента больше
+# FEED_COUNT_EXACT_LIMIT постов оценивается по наибольшему id.
+FEED_COUNT_TIMEOUT = 60 * 10
+FEED_COUNT_EXACT_LIMIT = 100_000
+
+# Материализованная лента подписок: посты раскладываются по лентам
+# подписчиков при публикации. После включения на существующей базе
+# выполните `python manage.py rebuild_timelines`.
+FOLLOW_TIMELINE = False
+
+# Сколько секунд браузеры и обратные прокси могут хранить страницы,
+# отданные гостю. На стороне сервера такие страницы инвалидируются
+# сигналами, а внешние кеши об этом не знают, поэтому срок короткий.
+ANONYMOUS_CACHE_TIME = 60
+
+# Миниатюры картинок постов: имя -> размер самого крупного варианта,
+# ширины вариантов для srcset, атрибут sizes и опции sorl-thumbnail.
+# Все варианты создаются в фоне после сохранения поста.
+POST_THUMBNAILS = {
+    'card': {
+        'size': (900, 339),
+        'widths': (360, 600, 900),
+        'sizes': '(max-width: 576px) 100vw, 900px',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+    'detail': {
+        'size': (960, 339),
+        'widths': (360, 640, 960),
+        'sizes': '(max-width: 768px) 100vw, 75vw',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+}
+
+# Форматы вариантов и их качество, от предпочтительного к запасному.
+# Форматы, которые установленный Pillow не умеет сохранять (WebP без
+# libwebp, AVIF без pillow-avif-plugin), пропускаются; последний должен
+# поддерживаться всеми браузерами.
+POST_IMAGE_FORMATS = {
+    'AVIF': 50,
+    'WEBP': 75,
+    'JPEG': 85,
+}
+
+# Число потоков фоновой генерации миниатюр в каждом процессе; 0 —
+# создавать миниатюры в самом запросе сразу после сохранения поста.
+THUMBNAIL_WORKERS = 2
+
+# Сколько найденных миниатюр помнит каждый процесс.
+THUMBNAIL_LRU_SIZE = 2048
+
+# Загрузки сразу пишутся во временный файл, а не в память; по дороге
+# отбрасываются файлы больше UPLOAD_MAX_BYTES и картинки больше
+# UPLOAD_MAX_PIXELS (по заголовку, без распаковки).
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.BoundedImageUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+UPLOAD_MAX_PIXELS = 40_000_000
+
+# Оригиналы с большей стороной крупнее этой уменьшаются в фоне.
+POST_IMAGE_MAX_SIDE = 2560
+
+# Файл картинки, загруженный или использованный повторно за последние
+# POST_IMAGE_RELEASE_GRACE секунд, не удаляется вместе с последним
+# постом: новый пост с ним может быть ещё не сохранён. Такие файлы
+# удаляет периодически запускаемая команда sweep_images.
+POST_IMAGE_RELEASE_GRACE = 60 * 60
+
+# Заголовок Server-Timing с разбивкой времени ответа (см. posts.profiling)
+# и доля запросов, профилируемых cProfile в PROFILING_DIR.
+SERVER_TIMING = True
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Метрики Prometheus на /metrics/ (см. posts.metrics). Воркеры gunicorn
+# складывают их в общий файл METRICS_DB раз в METRICS_FLUSH_INTERVAL
+# секунд; None — метрики только своего процесса. Страница открыта
+# персоналу и сборщику с заголовком Authorization: Bearer METRICS_TOKEN.
+# METRICS_ALLOWED_IPS стоит заполнять, только если приложение доступно
+# напрямую: за обратным прокси все запросы приходят с его адреса.
+METRICS_DB = None if DEBUG else os.path.join(BASE_DIR, 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ()
+
+# Запросы к базе дольше SLOW_QUERY_MS пишутся в лог и в сводку по
+# отпечаткам (см. posts.slow_queries); её разбирает команда
+# explain_queries. Сводка воркеров копится в общем файле SLOW_QUERY_DB.
+SLOW_QUERY_MS = 100
+SLOW_QUERY_DB = METRICS_DB